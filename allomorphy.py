@@ -12,10 +12,27 @@ The brute force part is: each combinations of 2 letters are attempted when tryin
 Increasing this number to 3 or more is wanted (since variations at a single position is not limited 2 letters)
 but painful since the number of combinations of letters increases exponentially if not 'factorially'
 (I don't know which is the correct description).
+
+With --classes, the letter pairs are replaced by classes of letters learned from the data
+(letters that are substituted for each other when aligning forms of the same features, e.g. {a/e}, {ı/i/u/ü}).
+Every letter of a class is mapped to one symbol and a single MLCS is computed per feature combination,
+so classes of any size cost one MLCS instead of one per combination of letters.
 """
 import argparse
-from itertools import combinations
-from feature_combo import get_unprocessed_data, get_feature_combi_dict
+import sys
+import time
+from collections import Counter, defaultdict
+from itertools import combinations, groupby
+from multiprocessing import Pool
+from operator import itemgetter
+from feature_combo import FormTable, get_feature_combi_postings
+from helper import lcs_pairs, m_longest_common_subsequence_3
+from profiles import get_profile
+from reader import ReaderStats, iter_unprocessed_data
+
+# the data is Turkish (wik_tur.csv)
+PROFILE = get_profile('tur')
+VOWELS = PROFILE.vowel_list
 
 
 class Model:
@@ -26,45 +43,190 @@ class Model:
         self.letter_combinations = None
         self.feature_form_dict = None
         self.MLCS = None
+        self.contiguous = False
+        self.prune = False
+        # how many letter pairs were computed, skipped because absent, or pruned
+        self.pair_stats = Counter()
 
-    def get_all_letters(self, data, separate=False):
-        # get every letter in the data and put it into a set
-        for form, lemma, fv in data:
+        # learned classes of letters (only classes of 2 or more letters)
+        self.letter_classes = None
+        # str.translate table: letter --> symbol of its class
+        self.class_table = None
+
+    def get_all_letters(self, forms, separate=False):
+        # get every letter in the forms and put it into a set
+        for form in forms:
             # convert to lower case
             self.all_letters.update(form.lower())
-        print('{} letters: {}'.format(len(self.all_letters), ','.join(self.all_letters)))
+        letters = sorted(self.all_letters)
+        print('{} letters: {}'.format(len(letters), ','.join(letters)))
 
         # combinations of letters
         # currently limited to 2 letter combinations TODO increase to 3?
         if separate:  # generate combinations for vowels and consonants separately
-            vowels = ['î', 'ü', 'ö', 'a', 'i', 'e', 'û', 'u', 'o', 'ı', 'â']
-            consonants = [s for s in self.all_letters if s not in vowels]
+            vowels = list(VOWELS)
+            consonants = [s for s in letters if s not in vowels]
             vowels.append('y')
             self.letter_combinations = list(combinations(vowels, 2)) + list(combinations(consonants, 2))
         else:
-            self.letter_combinations = list(combinations(self.all_letters, 2))
+            self.letter_combinations = list(combinations(letters, 2))
         print('{} combinations: {}'.format(len(self.letter_combinations), self.letter_combinations))
 
+    def encode_group(self, forms):
+        """Lowercase the forms of a group once and find the letters present in any of them.
+        With self.prune, also count the letters of each form and the smallest count of each letter"""
+        forms = [form.lower() for form in forms]
+        present = set().union(*forms)
+        if not self.prune:
+            return forms, present, None, None
+        histograms = [Counter(form) for form in forms]
+        # the smallest number of times each letter occurs in a form
+        min_counts = Counter()
+        for letter in present:
+            min_counts[letter] = min(histogram[letter] for histogram in histograms)
+        return forms, present, histograms, min_counts
+
+    @staticmethod
+    def pair_upper_bound(histograms, min_counts, a, b):
+        """Upper bound of the MLCS length when a and b count as the same letter:
+        a common subsequence cannot use a letter more often than its smallest count among the forms"""
+        merged = min(histogram[a] + histogram[b] for histogram in histograms)
+        return sum(min_counts.values()) - min_counts[a] - min_counts[b] + merged
+
     def find_allomorph(self, forms):
         """ Find MLCS of the forms.
         For example, if 'n' is the longest substring/sequence that occurs in all forms, then 'n' would be in the output.
-        If either 'a' or 'e' occurs in any forms, then {a/e} would be in the output. """
+        If either 'a' or 'e' occurs in any forms, then {a/e} would be in the output.
+        With self.prune, only the plain MLCS and the letter pair MLCS that are longer than it are kept,
+        and the pairs that cannot be longer according to the letter counts are not computed at all."""
         lcs_list = set()
+        forms, present, histograms, min_counts = self.encode_group(forms)
+        plain = self.MLCS(forms) if self.prune else None
         for a, b in self.letter_combinations:
-        forms = [form.lower() for form in forms]
+            if a not in present and b not in present:
+                # nothing to replace, so this is the plain MLCS
+                self.pair_stats['absent'] += 1
+                if plain is None:
+                    plain = self.MLCS(forms)
+                if plain:
+                    lcs_list.add(plain)
+                continue
+            if self.prune and self.pair_upper_bound(histograms, min_counts, a, b) <= len(plain):
+                self.pair_stats['pruned'] += 1
+                continue
+
             # a and b are two letters that we assume is the variation
             # so I pretend they are the same letter
             # (by replace each of them with a char that is not present in the alphabet)
             # and then find MLCS, and then replace them back with {a/b}
+            self.pair_stats['computed'] += 1
             archi = '{{{}/{}}}'.format(a, b)
             forms_copy = [form.replace(a, 'Q').replace(b, 'Q') for form in forms]
             # print(forms_copy)
             lcs = self.MLCS(forms_copy)
-            if lcs:
+            if lcs and (not self.prune or len(lcs) > len(plain)):
                 lcs_list.add(lcs.replace('Q', archi))
+        if self.prune and plain:
+            lcs_list.add(plain)
         # TODO cleanup the lcs_list because for example, whenever 'n' is in the list, {n/*} is also in the list
         return lcs_list
 
+    def learn_letter_classes(self, rows, min_count=5, separate=False):
+        """Learn which letters alternate with each other from (inflected_form, lemma, feature_vector) rows,
+        where the rows of a lemma are contiguous.
+        The stem of a lemma (the MLCS of its forms) is removed from its forms, so that only the endings are compared:
+        the endings of consecutive lemmas with the same feature vector are aligned with LCS. Where a single letter of
+        one ending faces a single different letter of the other between two aligned letters, the two letters are
+        counted as a substitution. Two classes are merged only if every letter of one is substituted for every
+        letter of the other at least min_count times, so classes do not grow by chaining pairs."""
+        # feature vector --> (lemma, ending) of every form, in the order of the rows
+        endings = defaultdict(list)
+        for lemma, lemma_rows in groupby(rows, key=itemgetter(1)):
+            lemma_rows = [(form.lower(), fv) for form, _, fv in lemma_rows]
+            stem = m_longest_common_subsequence_3([form for form, _ in lemma_rows])
+            for form, fv in lemma_rows:
+                if form.startswith(stem):
+                    endings[fv].append((lemma, form[len(stem):]))
+
+        substitutions = Counter()
+        for group in endings.values():
+            for (lemma1, form1), (lemma2, form2) in zip(group, group[1:]):
+                if lemma1 == lemma2:
+                    continue
+                pairs = [(-1, -1)] + lcs_pairs(form1, form2) + [(len(form1), len(form2))]
+                for (j1, k1), (j2, k2) in zip(pairs, pairs[1:]):
+                    if j2 - j1 == 2 and k2 - k1 == 2:
+                        a, b = form1[j1 + 1], form2[k1 + 1]
+                        if separate and (a in PROFILE.vowels) != (b in PROFILE.vowels):
+                            continue
+                        substitutions[tuple(sorted((a, b)))] += 1
+
+        # letter --> its class
+        classes = {}
+        for (a, b), count in substitutions.most_common():
+            if count < min_count:
+                break
+            class_a, class_b = classes.get(a, {a}), classes.get(b, {b})
+            if class_a is class_b:
+                continue
+            if all(substitutions[tuple(sorted((x, y)))] >= min_count for x in class_a for y in class_b):
+                merged = class_a | class_b
+                for letter in merged:
+                    classes[letter] = merged
+
+        self.letter_classes = sorted({tuple(sorted(c)) for c in classes.values()})
+        # private use characters cannot be in the data
+        self.class_table = {ord(letter): chr(0xE000 + i) for i, c in enumerate(self.letter_classes) for letter in c}
+        print('{} letter classes: {}'.format(len(self.letter_classes),
+                                             ' '.join('{{{}}}'.format('/'.join(c)) for c in self.letter_classes)))
+
+    def find_allomorph_classes(self, forms):
+        """ Find the MLCS of the forms where the letters of a class count as the same letter.
+        A position where different letters of a class occur is written with the letters that occur there,
+        e.g. l{a/e}r. Returns a set of (at most) one string, like find_allomorph."""
+        forms = [form.lower() for form in forms]
+        mapped = [form.translate(self.class_table) for form in forms]
+        lcs = self.MLCS(mapped)
+        if not lcs:
+            return set()
+
+        # the letters that occur at each position of the lcs, in the leftmost occurrence of the lcs in each form
+        letters = [set() for _ in lcs]
+        for form, mapped_form in zip(forms, mapped):
+            if self.contiguous:
+                start = mapped_form.find(lcs)
+                positions = range(start, start + len(lcs))
+            else:
+                positions = []
+                p = -1
+                for c in lcs:
+                    p = mapped_form.index(c, p + 1)
+                    positions.append(p)
+            for k, p in enumerate(positions):
+                letters[k].add(form[p])
+
+        return {''.join(c.pop() if len(c) == 1 else '{{{}}}'.format('/'.join(sorted(c))) for c in letters)}
+
+    def find(self, forms):
+        if self.letter_classes is not None:
+            return self.find_allomorph_classes(forms)
+        return self.find_allomorph(forms)
+
+
+# the model of a worker process, set up by init_worker
+worker_model = None
+
+
+def init_worker(model):
+    global worker_model
+    worker_model = model
+
+
+def allomorph_task(task):
+    feature, forms = task
+    worker_model.pair_stats = Counter()
+    return feature, worker_model.find(forms), worker_model.pair_stats
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
@@ -73,42 +235,82 @@ def parse_arguments():
     parser.add_argument('--combo_size', '-cs', help='the size of combination', default=2, type=int)
     parser.add_argument('--separate', '-sp', action='store_true',
                         help='separate vowels from consonants when considering possible variations')
+    parser.add_argument('--exact', '-ex', action='store_true',
+                        help='compute the exact MLCS (or longest common substring with --contiguous) of all forms '
+                             'instead of folding pairwise')
+    parser.add_argument('--jobs', '-j', help='number of processes computing the MLCS', default=1, type=int)
+    parser.add_argument('--classes', '-cl', action='store_true',
+                        help='learn classes of alternating letters and use them instead of letter pairs')
+    parser.add_argument('--class_min_count', '-cm', default=5, type=int,
+                        help='how many times every two letters of a class must be substituted for each other')
+    parser.add_argument('--prune', '-pr', action='store_true',
+                        help='only keep letter pairs whose MLCS is longer than the plain MLCS')
 
     return parser.parse_args()
 
 
 def main():
     args = parse_arguments()
-    print('contiguous: {}\ncombo size: {}\nseparate: {}'.format(args.contiguous, args.combo_size, args.separate))
+    start = time.time()
+    print('contiguous: {}\ncombo size: {}\nseparate: {}\nexact: {}'.format(args.contiguous, args.combo_size,
+                                                                        args.separate, args.exact))
 
+    table = FormTable()
+    stats = ReaderStats()
     with open('wik_tur.csv') as file:
-        data = get_unprocessed_data(file)
-
-    combi_forms_dict = {}
-    for i in range(1, args.combo_size + 1):
-        combi_forms_dict.update(get_feature_combi_dict(data, i))
-    key_list = [tuple(sorted(tuple(key))) for key in combi_forms_dict.keys()]
+        combi_postings = get_feature_combi_postings(iter_unprocessed_data(file, stats),
+                                                    range(1, args.combo_size + 1), table)
+    print(stats, file=sys.stderr)
+    key_list = [tuple(sorted(tuple(key))) for key in combi_postings.keys()]
     key_list.sort(key=lambda x: (len(x), x))
     print('{} combinations of features: {}'.format(len(key_list), key_list))
 
     m = Model()
-    m.get_all_letters(data, separate=args.separate)
+    m.get_all_letters(table.forms, separate=args.separate)
 
-    if args.contiguous:
+    if args.contiguous and args.exact:
+        from helper import m_longest_common_substring_exact as MLCS
+    elif args.contiguous:
         from helper import m_longest_common_substring as MLCS
+    elif args.exact:
+        from mlcs import MLCS
     else:
         from helper import m_longest_common_subsequence_3 as MLCS
     m.MLCS = MLCS
+    m.contiguous = args.contiguous
+    m.prune = args.prune
+
+    if args.classes:
+        # learn from the endings of the lemmas, which needs the rows again
+        with open('wik_tur.csv') as file:
+            m.learn_letter_classes(iter_unprocessed_data(file), min_count=args.class_min_count,
+                                   separate=args.separate)
+
+    tasks = [(feature, combi_postings[feature_set].forms(table))
+             for feature, feature_set in zip(key_list, map(frozenset, key_list))]
+    if args.jobs > 1:
+        # largest groups first, so that no big group is left running alone at the end
+        tasks.sort(key=lambda task: sum(len(form) for form in task[1]), reverse=True)
+        with Pool(args.jobs, initializer=init_worker, initargs=(m,)) as pool:
+            results = list(pool.imap_unordered(allomorph_task, tasks))
+    else:
+        results = [(feature, m.find(forms), None) for feature, forms in tasks]
+
+    combi_lcs_list_dict = {}
+    for feature, lcs_list, pair_stats in results:
+        combi_lcs_list_dict[feature] = lcs_list
+        if pair_stats is not None:
+            m.pair_stats.update(pair_stats)
+    if m.letter_classes is None:
+        print('letter pairs: {} computed, {} without any of the two letters, {} pruned, in {:.2f}s'.format(
+            m.pair_stats['computed'], m.pair_stats['absent'], m.pair_stats['pruned'], time.time() - start),
+            file=sys.stderr)
 
-    # combi_lcs_list_dict = {}
     for feature in key_list:
-        forms = combi_forms_dict[frozenset(feature)]
-        lcs_list = m.find_allomorph(forms)
-        # combi_lcs_list_dict[feature] = lcs_list
+        lcs_list = combi_lcs_list_dict[feature]
         # lcs_list = MLCS_2(forms)
         if lcs_list:
-            print('{}:\n{}'.format(feature, ','.join(lcs_list)))
-            # print(combi_lcs_list_dict)
+            print('{}:\n{}'.format(feature, ','.join(sorted(lcs_list))))
 
 
 if __name__ == '__main__':
@@ -6,31 +6,16 @@ Motivation: sometimes multiple features together determine a single morpheme.
 e.g. '3;SG' in English has 's' while neither '3' nor 'SG' entails the 's'.
 """
 
+import argparse
+import sys
+from array import array
 from collections import defaultdict
-from itertools import combinations
+from functools import partial
+from multiprocessing import Pool
+from features import FEATURES
 from helper import m_longest_common_subsequence_3 as MLCS
-from helper import powerset, subtract
-
-
-def get_unprocessed_data(file):
-    """ Read the csv file without doing any processing of the data
-    Input: csv file formatted as [inflected form],[lemma],[feature1;feature2;...]
-    Output: A list of tuples. The tuple is formatted as (inflected_form, lemma, feature_vector)
-    """
-    lst = []
-    for line in file:
-        inflected_form, lemma, fv = line.strip().split(',')
-        # ignore any inflection that contains spaces
-        if ' ' in inflected_form or ' ' in lemma or '{' in inflected_form or '?' in inflected_form or '-' in inflected_form:
-            continue
-
-        inflected_form = inflected_form.replace('*', '')
-
-        if '(' in inflected_form or '/' in inflected_form:
-            continue
-
-        lst.append((inflected_form, lemma, fv))
-    return lst
+from helper import SubsetIndex, subtract
+from reader import ReaderStats, iter_unprocessed_data
 
 
 def get_feature_combi_dict(tup_list, n):
@@ -42,44 +27,149 @@ def get_feature_combi_dict(tup_list, n):
     """
     feature_pair_count = defaultdict(list)
     for inflected_form, lemma, fv in tup_list:
-        fvs = fv.strip().split(';')
-        # print(len(list(combinations(fvs, r=2))))
-        for pair in combinations(fvs, r=n):
-            feature_pair_count[frozenset(pair)].append(inflected_form)
+        # the combinations are computed once per distinct feature vector
+        for combi in FEATURES.combinations(fv, (n,)):
+            feature_pair_count[combi].append(inflected_form)
 
     return feature_pair_count
 
 
+class FormTable:
+    """Interns forms: every distinct form is stored once and referred to by an integer id"""
+
+    def __init__(self):
+        self.forms = []
+        self.ids = {}
+
+    def intern(self, form):
+        form_id = self.ids.get(form)
+        if form_id is None:
+            form_id = len(self.forms)
+            self.ids[form] = form_id
+            self.forms.append(form)
+        return form_id
+
+    def __getitem__(self, form_id):
+        return self.forms[form_id]
+
+    def __len__(self):
+        return len(self.forms)
+
+
+class Postings:
+    """The distinct forms of a feature combination, as form ids in order of first occurrence, with their counts"""
+    __slots__ = ('ids', 'counts')
+
+    def __init__(self, ids, counts):
+        self.ids = ids
+        self.counts = counts
+
+    def total(self):
+        return sum(self.counts)
+
+    def forms(self, table):
+        return [table[form_id] for form_id in self.ids]
+
+
+def get_feature_combi_postings(tup_list, sizes, table):
+    """Same as get_feature_combi_dict, for every n in sizes, but the forms are interned in table and each
+    combination only keeps array('I') of distinct form ids and their counts instead of a list of strings"""
+    feature_combi_ids = defaultdict(lambda: array('I'))
+    for inflected_form, lemma, fv in tup_list:
+        form_id = table.intern(inflected_form)
+        for combi in FEATURES.combinations(fv, sizes):
+            feature_combi_ids[combi].append(form_id)
+
+    # collapse duplicates one combination at a time
+    postings = {}
+    for combi in list(feature_combi_ids):
+        counts = {}
+        for form_id in feature_combi_ids.pop(combi):
+            counts[form_id] = counts.get(form_id, 0) + 1
+        postings[combi] = Postings(array('I', counts.keys()), array('I', counts.values()))
+    return postings
+
+
+def mlcs_task(task, mlcs=MLCS):
+    features, forms = task
+    return features, mlcs(forms)
+
+
+def compute_mlcs(tasks, jobs=1, mlcs=MLCS):
+    """Run mlcs on a list of (features, forms). With jobs > 1, the tasks are spread over a process pool,
+    the largest ones first so that a big group does not start last and keep the other workers waiting."""
+    task = partial(mlcs_task, mlcs=mlcs)
+    if jobs > 1:
+        tasks = sorted(tasks, key=lambda task: sum(len(form) for form in task[1]), reverse=True)
+        with Pool(jobs) as pool:
+            return dict(pool.imap_unordered(task, tasks))
+    return dict(map(task, tasks))
+
+
+def compute_lattice_lcs(combi_postings, table, jobs=1, mlcs=MLCS):
+    """MLCS of the forms of every feature combination, going through the combinations by size.
+    A combination that has exactly the same forms (in the same order) as one of its subsets
+    has the same MLCS, so it is copied from the subset instead of being computed again."""
+    # feature combination --> the combination whose MLCS it uses
+    source = {}
+    for features in sorted(combi_postings, key=len):
+        postings = combi_postings[features]
+        source[features] = features
+        for feature in features:
+            subset = features - {feature}
+            if subset in source and combi_postings[subset].ids == postings.ids:
+                source[features] = source[subset]
+                break
+
+    # duplicated forms do not change the MLCS
+    tasks = [(features, combi_postings[features].forms(table)) for features, src in source.items() if src == features]
+    computed = compute_mlcs(tasks, jobs, mlcs)
+    return {features: computed[src] for features, src in source.items()}
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', '-j', help='number of processes computing the MLCS', default=1, type=int)
+    parser.add_argument('--exact', '-ex', action='store_true',
+                        help='compute the exact MLCS of all forms instead of folding pairwise')
+
+    return parser.parse_args()
+
+
 def main():
+    args = parse_arguments()
+
+    table = FormTable()
+    stats = ReaderStats()
     with open('wik_tur.csv') as file:
-        data = get_unprocessed_data(file)
+        # from 1 to 4
+        combi_postings = get_feature_combi_postings(iter_unprocessed_data(file, stats), range(1, 5), table)
+    print(stats, file=sys.stderr)
 
-    combi_forms_dict = {}
-    # from 1 to 4
-    for i in range(1, 5):
-        combi_forms_dict.update(get_feature_combi_dict(data, i))
+    if args.exact:
+        from mlcs import MLCS as mlcs
+    else:
+        mlcs = MLCS
 
     print('computing lcs')
     combi_lcs_dict = {}
     combi_count_dict = {}
-    for features, forms in combi_forms_dict.items():
-        lcs = MLCS(forms)
-        count = len(forms)
+    for features, lcs in compute_lattice_lcs(combi_postings, table, args.jobs, mlcs).items():
         if lcs:
             combi_lcs_dict[features] = lcs
-            combi_count_dict[features] = count
-    del combi_forms_dict
+            combi_count_dict[features] = combi_postings[features].total()
+    del combi_postings
 
     print('refining lcs')
+    index = SubsetIndex(combi_lcs_dict.keys())
     results = []
     for features, lcs in combi_lcs_dict.items():
         # remove parts that is already been accounted for in any subset of the features
         # for example, if features {a;b;c} has lcs 'abc',
         # and features {a;b} has lcs 'ab', and each of other subsets of {a;b;c} do not have a lcs
         # then the 'ab' is subtracted from 'abc' so that 'c' is what {a;b;c} contribute as a whole means
-        for feature_subset in powerset(features):
-            feature_subset = frozenset(feature_subset)
-            if feature_subset != features and feature_subset in combi_lcs_dict.keys():
+        for feature_subset in index.subsets(features):
+            if feature_subset != features:
                 lcs = subtract(lcs, combi_lcs_dict[feature_subset])
         if lcs:
             results.append((features, ''.join(lcs), combi_count_dict[features]))
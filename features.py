@@ -0,0 +1,154 @@
+"""
+Feature vectors as integers.
+
+Every feature (e.g. 'PL') is given one bit by a FeatureRegistry, so a feature vector such as 'N;PL;ACC' is an int,
+and subset, difference and "how many features differ" are single integer operations.
+With a UniMorph schema loaded, each dimension (e.g. Number) also has a mask of the bits of its features,
+so "do these two features belong to the same dimension" is one AND.
+"""
+from itertools import combinations
+
+
+def bits_of(mask):
+    """Yield the single bit masks of mask"""
+    while mask:
+        bit = mask & -mask
+        yield bit
+        mask ^= bit
+
+
+# largest number of entries of each cache of a FeatureRegistry before it is cleared
+CACHE_SIZE = 1 << 16
+
+
+class FeatureRegistry:
+    """Interns features and feature vectors.
+    The bits of the features are only meaningful within one registry, and loading a schema changes its dimensions,
+    so analyses with different schemas should each have their own registry."""
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        # feature --> bit
+        self.bits = {}
+        # bit --> feature
+        self.names = {}
+        # bit --> mask of all the features of its dimension
+        self.dimension_masks = {}
+        # features that are in the same dimension as any other feature (the empty feature)
+        self.wildcard = 0
+
+        # caches: 'A;B;C' --> mask, 'A;B;C' --> tuple of features,
+        # mask --> frozenset of features, (mask, sizes) --> combinations
+        # each cache is cleared when it reaches cache_size entries, so that it stays bounded on large corpora
+        self.cache_size = cache_size
+        self.parsed = {}
+        self.split_vectors = {}
+        self.frozensets = {}
+        self.combination_lists = {}
+
+    def clear_caches(self):
+        self.parsed.clear()
+        self.split_vectors.clear()
+        self.frozensets.clear()
+        self.combination_lists.clear()
+
+    def cache(self, cache, key, value):
+        if len(cache) >= self.cache_size:
+            cache.clear()
+        cache[key] = value
+        return value
+
+    def bit(self, feature):
+        bit = self.bits.get(feature)
+        if bit is None:
+            bit = 1 << len(self.bits)
+            self.bits[feature] = bit
+            self.names[bit] = feature
+            if feature == '':
+                self.wildcard |= bit
+        return bit
+
+    def encode(self, features):
+        """Mask of a feature vector, given as 'A;B;C', as an iterable of features or already as a mask"""
+        if isinstance(features, int):
+            return features
+        if isinstance(features, str):
+            mask = self.parsed.get(features)
+            if mask is None:
+                mask = self.cache(self.parsed, features, self.encode(self.split(features)))
+            return mask
+        mask = 0
+        for feature in features:
+            mask |= self.bit(feature)
+        return mask
+
+    def split(self, features):
+        """The features of 'A;B;C' as a tuple, in their order, parsed once per distinct string"""
+        split = self.split_vectors.get(features)
+        if split is None:
+            split = self.cache(self.split_vectors, features, tuple(features.strip().split(';')))
+        return split
+
+    def decode(self, mask):
+        """The (interned) frozenset of the features of a mask"""
+        features = self.frozensets.get(mask)
+        if features is None:
+            features = self.cache(self.frozensets, mask, frozenset(self.names[bit] for bit in bits_of(mask)))
+        return features
+
+    def feature_set(self, features):
+        """Interned frozenset of a feature vector given as 'A;B;C' or as an iterable"""
+        return self.decode(self.encode(features))
+
+    def combinations(self, features, sizes):
+        """All the sub-vectors of the given sizes, as interned frozensets, computed once per distinct vector"""
+        mask = self.encode(features)
+        key = (mask, tuple(sizes))
+        combination_list = self.combination_lists.get(key)
+        if combination_list is None:
+            bits = list(bits_of(mask))
+            combination_list = self.cache(self.combination_lists, key, [self.decode(sum(combi)) for n in key[1]
+                                                                         for combi in combinations(bits, n)])
+        return combination_list
+
+    def load_dimensions(self, reverse_schema):
+        """Build the dimension masks from a feature --> dimension map.
+        Dimensions that are not strings (lists, as for the hardcoded {IPFV/...} features) are grouped by value."""
+        dimension_features = {}
+        for feature, dimension in reverse_schema.items():
+            key = dimension if isinstance(dimension, str) else ('list', tuple(dimension))
+            dimension_features.setdefault(key, 0)
+            dimension_features[key] |= self.bit(feature)
+        for mask in dimension_features.values():
+            for bit in bits_of(mask):
+                self.dimension_masks[bit] = mask
+
+    def in_same_dimension(self, bit1, bit2):
+        if (bit1 | bit2) & self.wildcard:
+            return True
+        dimension_mask = self.dimension_masks.get(bit1, 0)
+        return dimension_mask & bit2 != 0
+
+    def differ_by_one_dimension(self, mask1, mask2):
+        """
+        differ by one dimension == is minimal pair
+
+        V;1;SG and V;2;PL --> False
+        V;1;SG;PRS and V;1;SG --> True
+        V;1;SG;PRS and V;1;SG;PST --> True
+        V;1;SG;PRS and V;1;SG;PRS --> False
+        """
+        diff = mask1 ^ mask2
+        if diff == 0:
+            return False
+        low = diff & -diff
+        rest = diff ^ low
+        if rest == 0:  # one feature
+            return True
+        if rest & (rest - 1):  # three or more features
+            return False
+        return self.in_same_dimension(low, rest)
+
+
+# a registry for the scripts that do not load a schema and keep no masks of their own:
+# feature_combo (combinations) and segmentation (only the cached parsing of 'A;B;C')
+FEATURES = FeatureRegistry()
@@ -1,8 +1,34 @@
 # subsequence
+import math
+from collections import defaultdict
 from itertools import chain, combinations
 
+from profiles import get_profile
 
-def LCS(X, Y):
+
+# Which engine LCS() and lcs_length() use: 'bitparallel' or 'dp'.
+# Both give identical results; 'dp' is the original list-of-lists table.
+LCS_BACKEND = 'bitparallel'
+
+# vowels that the LCS tracebacks avoid when breaking ties (bias toward consonants in the stem)
+VOWELS = get_profile('default').vowels
+
+
+def set_lcs_backend(name):
+    global LCS_BACKEND
+    if name not in ('bitparallel', 'dp'):
+        raise ValueError('unknown LCS backend: {}'.format(name))
+    LCS_BACKEND = name
+
+
+def LCS(X, Y, vowels=VOWELS):
+    """LCS of two strings using the selected backend (see LCS_BACKEND)"""
+    if LCS_BACKEND == 'bitparallel':
+        return LCS_bitparallel(X, Y, vowels)
+    return LCS_dp(X, Y, vowels)
+
+
+def LCS_dp(X, Y, vowels=VOWELS):
     """
     First finds a table (matrix) such that L[j][k] is length of longest common subsequence for X[0:j] and Y[0:k].
     Then, uses tracebacks through this table to print the actual LCS.
@@ -30,10 +56,10 @@ def LCS(X, Y):
             k -= 1
         elif L[j - 1][k] == L[j][k - 1]:  # Original algorithm didn't adequately deal with case in which
             # cell to the left or above were equally good.
-            if X[j - 2] == Y[k - 1] and X[j - 2] not in {"a", "e", "i", "o", "u"}:  # Bias toward consonants in stem.
-                j -= 1  # Eventually, need to not hardcode the vowels!!
-            elif X[j - 1] == Y[k - 2] and Y[k - 2] not in {"a", "e", "i", "o", "u"}:  # Bias toward consonants in stem.
-                k -= 1  # Eventually, need to not hardcode the vowels!!
+            if X[j - 2] == Y[k - 1] and X[j - 2] not in vowels:  # Bias toward consonants in stem.
+                j -= 1
+            elif X[j - 1] == Y[k - 2] and Y[k - 2] not in vowels:  # Bias toward consonants in stem.
+                k -= 1
             else:  # Default directionality: Leftward in chart.
                 k -= 1
         else:  # Default directionality: Leftward in chart.
@@ -41,6 +67,96 @@ def LCS(X, Y):
     return ''.join(reversed(solution))
 
 
+def match_masks(Y):
+    """Map each character of Y to a bitmask of the positions where it occurs (bit k <-> Y[k])"""
+    masks = {}
+    bit = 1
+    for ch in Y:
+        masks[ch] = masks.get(ch, 0) | bit
+        bit <<= 1
+    return masks
+
+
+def lcs_rows(X, Y):
+    """
+    Bit-parallel LCS (Allison-Dix / Hyyro). Instead of filling a row of the DP table cell by cell,
+    a whole row is kept as one integer V whose bits are the horizontal deltas of the row:
+    bit k of V is 0 iff L[j][k + 1] == L[j][k] + 1.
+    rows[j] is V after consuming X[0:j], so L[j][k] == k - popcount(rows[j] & ((1 << k) - 1)).
+    """
+    masks = match_masks(Y)
+    full = (1 << len(Y)) - 1
+    V = full
+    rows = [V]
+    for ch in X:
+        U = V & masks.get(ch, 0)
+        V = ((V + U) | (V - U)) & full
+        rows.append(V)
+    return rows
+
+
+class _BitRow:
+    """One row of a BitParallelLCSTable, indexable like a row of the lcs_length matrix"""
+    __slots__ = ('V',)
+
+    def __init__(self, V):
+        self.V = V
+
+    def __getitem__(self, k):
+        return k - bin(self.V & ((1 << k) - 1)).count('1')
+
+
+class BitParallelLCSTable:
+    """Drop-in replacement of the lcs_length matrix: C[i][j] is the LCS length of X[0:i] and Y[0:j]"""
+
+    def __init__(self, X, Y):
+        self.rows = lcs_rows(X, Y)
+
+    def __getitem__(self, i):
+        return _BitRow(self.rows[i])
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def LCS_bitparallel(X, Y, vowels=VOWELS):
+    """Same as LCS_dp (including the consonant bias when breaking ties), but the table is kept as bitvectors"""
+    return ''.join(X[j] for j, k in lcs_pairs(X, Y, vowels))
+
+
+def lcs_pairs(X, Y, vowels=VOWELS):
+    """Positions (j, k), in increasing order, of the characters X[j] == Y[k] matched by LCS(X, Y)"""
+    rows = lcs_rows(X, Y)
+
+    def L(j, k):
+        return k - bin(rows[j] & ((1 << k) - 1)).count('1')
+
+    solution = []
+    j, k = len(X), len(Y)
+    length = L(j, k)
+    while length > 0:
+        if X[j - 1] == Y[k - 1]:
+            solution.append((j - 1, k - 1))
+            j -= 1
+            k -= 1
+            length -= 1
+            continue
+        up, left = L(j - 1, k), L(j, k - 1)
+        if up > left:
+            j -= 1
+        elif up < left:
+            k -= 1
+        else:
+            if X[j - 2] == Y[k - 1] and X[j - 2] not in vowels:  # Bias toward consonants in stem.
+                j -= 1
+            elif X[j - 1] == Y[k - 2] and Y[k - 2] not in vowels:  # Bias toward consonants in stem.
+                k -= 1
+            else:  # Default directionality: Leftward in chart.
+                k -= 1
+        length = L(j, k)
+    return list(reversed(solution))
+
+
 def m_longest_common_subsequence_2(s):
     """An iterative method to compute MLCS"""
 
@@ -49,12 +165,28 @@ def m_longest_common_subsequence_2(s):
 
     lcs = lst[0]
     for string in lst[1:]:
+        if not lcs:
+            break
+        if is_subsequence(lcs, string):  # then LCS(lcs, string) is lcs itself
+            continue
         lcs = LCS(lcs, string)
 
     return lcs
 
 
+def is_subsequence(a, s):
+    """True if a is a subsequence of s"""
+    it = iter(s)
+    return all(c in it for c in a)
+
+
 def lcs_length(X, Y):
+    if LCS_BACKEND == 'bitparallel':
+        return BitParallelLCSTable(X, Y)
+    return lcs_length_dp(X, Y)
+
+
+def lcs_length_dp(X, Y):
     m = len(X)
     n = len(Y)
     # An (m+1) times (n+1) matrix
@@ -82,9 +214,94 @@ def back_track_all(C, X, Y, i, j):
         return R
 
 
+class LCSDag:
+    """
+    All the LCS of X and Y as a DAG over positions (i, j) = "X[i:] and Y[j:] are left to match".
+    An edge labelled c goes from (i, j) to just after the leftmost c in X[i:] and in Y[j:], and only exists
+    if an LCS of the rest can still be completed from there. Taking the leftmost occurrence means that
+    every distinct LCS is exactly one path, so walking the DAG never yields duplicates, and since every edge
+    leads to a complete LCS the walk never backtracks out of a dead end.
+    Successors are computed on demand and memoized per node, so shared subproblems are only expanded once.
+    """
+
+    def __init__(self, X, Y):
+        self.X = X
+        self.Y = Y
+        # suffix LCS lengths: LCS(X[i:], Y[j:]) == LCS of the reversed prefixes
+        self.suffix_table = BitParallelLCSTable(X[::-1], Y[::-1])
+        self.alphabet = sorted(set(X) & set(Y))
+        self.successors = {}
+
+    def remaining(self, i, j):
+        """Length of the LCS of X[i:] and Y[j:]"""
+        return self.suffix_table[len(self.X) - i][len(self.Y) - j]
+
+    def edges(self, i, j):
+        """List of (char, next_i, next_j) leaving node (i, j)"""
+        node = (i, j)
+        if node in self.successors:
+            return self.successors[node]
+        r = self.remaining(i, j)
+        edges = []
+        if r > 0:
+            for c in self.alphabet:
+                x = self.X.find(c, i)
+                if x == -1:
+                    continue
+                y = self.Y.find(c, j)
+                if y == -1:
+                    continue
+                if self.remaining(x + 1, y + 1) == r - 1:
+                    edges.append((c, x + 1, y + 1))
+        self.successors[node] = edges
+        return edges
+
+    def __iter__(self):
+        return iter_lcs_dag(self)
+
+
+def iter_lcs_dag(dag, limit=None):
+    """Yield the distinct LCS strings of a LCSDag lazily (in alphabetical order), at most `limit` of them"""
+    if limit is not None and limit <= 0:
+        return
+    count = 0
+    prefix = []
+    stack = [iter(dag.edges(0, 0))]
+    while stack:
+        edge = next(stack[-1], None)
+        if edge is None:
+            stack.pop()
+            if prefix:
+                prefix.pop()
+            continue
+        c, i, j = edge
+        prefix.append(c)
+        edges = dag.edges(i, j)
+        if edges:
+            stack.append(iter(edges))
+            continue
+        yield ''.join(prefix)
+        prefix.pop()
+        count += 1
+        if limit is not None and count >= limit:
+            return
+    if count == 0:  # no common character at all: the only LCS is the empty string
+        yield ''
+
+
+def iter_lcs(X, Y, limit=None):
+    """Lazily yield the distinct longest common subsequences of X and Y, at most `limit` of them"""
+    return iter_lcs_dag(LCSDag(X, Y), limit)
+
+
+def first_lcs(X, Y, n=1):
+    """The first n distinct LCS of X and Y (alphabetical order of the path labels)"""
+    return list(iter_lcs(X, Y, limit=n))
+
+
 def all_lcs(X, Y):
     """find *all* longest common subsequence"""
-    return back_track_all(lcs_length(X, Y), X, Y, len(X), len(Y))
+    return set(iter_lcs(X, Y))
 
 
 def m_longest_common_subsequence_3(iterable):
@@ -93,7 +310,13 @@ def m_longest_common_subsequence_3(iterable):
 
     lcs = lst[0]
     for string in lst[1:]:
-        lcs = all_lcs(lcs, string).pop()  # TODO select a LCS instead of popping the last one
+        if not lcs:
+            break
+        if is_subsequence(lcs, string):  # then the only LCS of the two is lcs itself
+            continue
+        # only one LCS is kept, so only generate one instead of all of them
+        # TODO select a LCS instead of taking the first one
+        lcs = next(iter_lcs(lcs, string))
 
     return lcs
 
@@ -116,7 +339,106 @@ def longest_common_substring(s1, s2):
     return s1[x_longest - longest: x_longest]
 
 
+class SuffixAutomaton:
+    """
+    Generalized suffix automaton of several strings. Every state is a class of substrings that end at the same
+    positions, so "in how many strings does this substring occur" only has to be counted once per state.
+    length[v] is the longest substring of state v and end[v] = (string index, end index) one occurrence of it.
+    """
+
+    def __init__(self, strings):
+        self.strings = strings
+        self.next = [{}]
+        self.link = [-1]
+        self.length = [0]
+        self.end = [(0, 0)]
+        for index, s in enumerate(strings):
+            last = 0
+            for position, c in enumerate(s):
+                last = self.extend(last, c, (index, position + 1))
+
+    def new_state(self, length, end, transitions=None, link=-1):
+        self.next.append(transitions if transitions is not None else {})
+        self.link.append(link)
+        self.length.append(length)
+        self.end.append(end)
+        return len(self.length) - 1
+
+    def clone(self, p, q, c):
+        clone = self.new_state(self.length[p] + 1, self.end[q], dict(self.next[q]), self.link[q])
+        while p != -1 and self.next[p].get(c) == q:
+            self.next[p][c] = clone
+            p = self.link[p]
+        self.link[q] = clone
+        return clone
+
+    def extend(self, last, c, end):
+        if c in self.next[last]:  # the substring already exists because of a previous string
+            q = self.next[last][c]
+            if self.length[last] + 1 == self.length[q]:
+                return q
+            return self.clone(last, q, c)
+
+        cur = self.new_state(self.length[last] + 1, end)
+        p = last
+        while p != -1 and c not in self.next[p]:
+            self.next[p][c] = cur
+            p = self.link[p]
+        if p == -1:
+            self.link[cur] = 0
+        else:
+            q = self.next[p][c]
+            if self.length[p] + 1 == self.length[q]:
+                self.link[cur] = q
+            else:
+                self.link[cur] = self.clone(p, q, c)
+        return cur
+
+    def string_counts(self, weights=None):
+        """count[v] = (weighted) number of strings that contain the substrings of state v.
+        The states that contain a substring of a string are the suffix link ancestors of the states reached by its
+        prefixes. Each string walks up from those and marks the states it has seen (last[v]), stopping at a state
+        it already marked, so a state is counted once per string with one integer per state."""
+        count = [0] * len(self.length)
+        count[0] = sum(weights) if weights is not None else len(self.strings)  # the empty string
+        last = [-1] * len(self.length)
+        for index, s in enumerate(self.strings):
+            weight = weights[index] if weights is not None else 1
+            state = 0
+            for c in s:
+                state = self.next[state][c]
+                v = state
+                while v > 0 and last[v] != index:
+                    last[v] = index
+                    count[v] += weight
+                    v = self.link[v]
+        return count
+
+    def last_ends(self):
+        """last_end[v] = the last end index of the substrings of state v (their last occurrence ends there)"""
+        last_end = [end for index, end in self.end]
+        for v in sorted(range(1, len(self.length)), key=self.length.__getitem__, reverse=True):
+            if last_end[v] > last_end[self.link[v]]:
+                last_end[self.link[v]] = last_end[v]
+        return last_end
+
+    def longest_common(self, min_count, weights=None):
+        """Longest substring that occurs in at least min_count strings (earliest occurrence wins ties)"""
+        count = self.string_counts(weights)
+        best = 0
+        for v in range(1, len(self.length)):
+            if count[v] >= min_count:
+                if self.length[v] > self.length[best] or (
+                        self.length[v] == self.length[best] and self.end[v] < self.end[best]):
+                    best = v
+        index, end = self.end[best]
+        return self.strings[index][end - self.length[best]:end] if best else ''
+
+
 def m_longest_common_substring(it):
+    """An iterative method to compute the longest common substring of all the strings (pairwise fold).
+    The fold can miss the real longest common substring, see m_longest_common_substring_exact,
+    but it is faster on the short forms of the data."""
     lst = list(it)
 
     lcs = lst[0]
@@ -126,9 +448,111 @@ def m_longest_common_substring(it):
     return lcs
 
 
+def m_longest_common_substring_exact(it, min_fraction=1.0):
+    """Longest substring that occurs in all the strings of the iterable,
+    or in at least min_fraction of them (counting duplicates), with a generalized suffix automaton"""
+    lst = list(it)
+    if not lst:
+        return ''
+    distinct = sorted(set(lst))
+    multiplicity = defaultdict(int)
+    for string in lst:
+        multiplicity[string] += 1
+    weights = [multiplicity[string] for string in distinct]
+    min_count = max(1, int(math.ceil(min_fraction * len(lst) - 1e-9)))
+    return SuffixAutomaton(distinct).longest_common(min_count, weights)
+
+
+# multiple pattern matching
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton: finds every occurrence of every pattern in a text in a single pass.
+    finditer yields (start, end, pattern index) in the order in which the occurrences end.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for c in pattern:
+                if c not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][c] = len(self.goto) - 1
+                state = self.goto[state][c]
+            self.output[state].append(index)
+
+        # breadth first, so that the failure state of a node is always done before the node
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for c, child in self.goto[state].items():
+                queue.append(child)
+                f = self.fail[state]
+                while f and c not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f].get(c, 0) if self.goto[f].get(c) != child else 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def finditer(self, text):
+        state = 0
+        for position, c in enumerate(text):
+            while state and c not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(c, 0)
+            for index in self.output[state]:
+                yield position + 1 - len(self.patterns[index]), position + 1, index
+
+
 # other
 
 
+class SubsetIndex:
+    """
+    Index of feature sets that answers "which stored sets are subsets of this one" without enumerating
+    the powerset of the query. The sets are stored in a trie along their features sorted by an id given
+    to each feature, so a query only walks down the branches made of its own features.
+    """
+
+    def __init__(self, keys=()):
+        self.ids = {}
+        self.root = [{}, None]  # [children by feature id, stored key ending here]
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        key = frozenset(key)
+        node = self.root
+        for feature_id in sorted(self.ids.setdefault(feature, len(self.ids)) for feature in key):
+            children = node[0]
+            if feature_id not in children:
+                children[feature_id] = [{}, None]
+            node = children[feature_id]
+        node[1] = key
+
+    def subsets(self, query):
+        """Yield the stored sets that are subsets of query (including query itself if stored)"""
+        q = sorted(self.ids[feature] for feature in set(query) if feature in self.ids)
+        stack = [(self.root, 0)]
+        while stack:
+            node, start = stack.pop()
+            if node[1] is not None:
+                yield node[1]
+            children = node[0]
+            if not children:
+                continue
+            for i in range(start, len(q)):
+                child = children.get(q[i])
+                if child is not None:
+                    stack.append((child, i + 1))
+
+
 def powerset(iterable):
     """powerset([1,2,3]) --> () (1,) (2,) (3,) (1,2) (1,3) (2,3) (1,2,3)"""
     s = list(iterable)
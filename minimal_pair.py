@@ -1,17 +1,62 @@
 # cython: language_level=3
-from collections import defaultdict
-from difflib import ndiff
+import argparse
+import sys
+from collections import Counter, defaultdict
+from copy import copy
+from difflib import SequenceMatcher, ndiff
+from functools import lru_cache
 from itertools import combinations
+from multiprocessing import Pool
 
-from feature_combo import get_unprocessed_data
+from features import FeatureRegistry, bits_of
+from helper import lcs_pairs
+import store
+
+from reader import ReaderStats, chunked, iter_unprocessed_data
+
+# lemmas per task of produce_possible_morphs_from_minimal_pair
+SHARD_SIZE = 500
+
+# morphs per feature of generate_correlation
+TOP_K = 10
 
 
 def defaultdict_of_int():
     return defaultdict(int)
 
 
+@lru_cache(maxsize=1 << 16)
+def char_diff(form1, form2):
+    """Return (chars only in form1, chars only in form2), the same as the '-' and '+' lines of ndiff(form1, form2).
+    On characters ndiff never finds a similar enough pair to do an intraline diff, so its output is only
+    the opcodes of SequenceMatcher, which are used directly here. Cached because the same pairs of endings
+    come up again and again across lemmas."""
+    if len(form1) >= 200 or len(form2) >= 200:  # SequenceMatcher's autojunk heuristic kicks in, leave it to ndiff
+        delta = list(ndiff(form1, form2))
+        return (''.join([x[2:] for x in delta if x.startswith('-')]),
+                ''.join([x[2:] for x in delta if x.startswith('+')]))
+
+    only_in_form1 = []
+    only_in_form2 = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, form1, form2).get_opcodes():
+        if tag != 'equal':
+            only_in_form1.append(form1[i1:i2])
+            only_in_form2.append(form2[j1:j2])
+    return ''.join(only_in_form1), ''.join(only_in_form2)
+
+
+@lru_cache(maxsize=1 << 16)
+def char_diff_lcs(form1, form2):
+    """Like char_diff, but the characters that are kept are those of the LCS of the two forms"""
+    pairs = lcs_pairs(form1, form2)
+    kept1 = {j for j, k in pairs}
+    kept2 = {k for j, k in pairs}
+    return (''.join(c for j, c in enumerate(form1) if j not in kept1),
+            ''.join(c for k, c in enumerate(form2) if k not in kept2))
+
+
 class Segmenter:
-    def __init__(self):
+    def __init__(self, features=None):
 
         # category/dimension --> list of features
         self.schema = None
@@ -25,7 +70,15 @@ class Segmenter:
         # feature --> morph --> count
         self.feature_morph_count = None
 
-    def produce_possible_morphs_from_minimal_pair(self):
+        # (form1, form2) --> (chars only in form1, chars only in form2)
+        self.char_diff = char_diff
+
+        # feature vectors as bitmasks, with the dimension masks of the schema.
+        # Each segmenter has its own registry (read_unimorph_schema changes it), unless one is given to share.
+        self.features = features if features is not None else FeatureRegistry()
+
+    def produce_possible_morphs_from_minimal_pair(self, use_index=True, jobs=1, shard_size=SHARD_SIZE,
+                                                  progress=False):
         """Generate a list of possible morphs for each feature by comparing minimal pairs
             input: a dictionary: lemma --> fv --> form
             1. find fv minimal pairs
@@ -34,37 +87,110 @@ class Segmenter:
             For example, V;SG;1 and V;PL;1 is a minimal pair.
             If for a lemma, V;SG;1 is 'blahsg', and V;PL;1 is 'blahpl',
             then 'sg' is added to the list for feature SG, and 'pl' is added to the list for feature PL.
-        """
 
+            With use_index, the minimal pairs are found with minimal_pairs_indexed instead of testing every pair.
+
+            The lemmas are split in shards of shard_size lemmas, which are counted by count_shard in jobs processes
+            and merged in shard order, so the result (including the order of the dicts) does not depend on jobs.
+            With progress, the number of lemmas done is printed to stderr.
+        """
+        shards = chunked(self.lemma_fv_form_dict.values(), shard_size)
+        if jobs > 1:
+            # give every feature its bit here, before the registry is copied to the workers: a bit that a worker
+            # gave to a new feature would not exist here when the masks come back
+            for fv_s in self.lemma_fv_form_dict.values():
+                for fv in fv_s:
+                    self.features.encode(fv)
+            # the workers only need the schema, not the data or a previous result
+            worker = copy(self)
+            worker.lemma_fv_form_dict = None
+            worker.feature_morph_count = None
+            with Pool(jobs, initializer=init_worker, initargs=(worker, use_index)) as pool:
+                self.feature_morph_count = self.merge_shards(pool.imap(count_shard_task, shards), progress)
+        else:
+            partials = (self.count_shard(shard, use_index) for shard in shards)
+            self.feature_morph_count = self.merge_shards(partials, progress)
+
+    def count_shard(self, shard, use_index=True):
+        """Count the morphs of the minimal pairs of a list of (fv --> form) dicts.
+        Returns (number of lemmas, Counter of (feature bitmask, morph) --> count)"""
+        counts = Counter()
+        for fv_s in shard:
+            # feature vectors as bitmasks
+            fv_s = {self.features.encode(fv): form for fv, form in fv_s.items()}
+
+            # for any minimal pair of fv
+            pairs = self.minimal_pairs_indexed(fv_s) if use_index else self.minimal_pairs_pairwise(fv_s)
+            for fv1, fv2 in pairs:
+                form1 = fv_s[fv1]
+                form2 = fv_s[fv2]
+
+                chars_only_in_form1, chars_only_in_form2 = self.char_diff(form1, form2)
+                feature1 = fv1 & ~fv2
+                feature2 = fv2 & ~fv1
+                # print('{}:{} \t {}: {}'.format(''.join(feature1), chars_only_in_form1, ''.join(feature2),
+                #                                chars_only_in_form2))
+
+                # count ++
+                if feature1:
+                    counts[feature1, chars_only_in_form1] += 1
+                if feature2:
+                    counts[feature2, chars_only_in_form2] += 1
+        return len(shard), counts
+
+    def merge_shards(self, partials, progress=False):
+        """Sum the (number of lemmas, counts) of count_shard into feature --> morph --> count"""
         # feature --> morph --> count
         feature_morph_dict = defaultdict(defaultdict_of_int)
-
-        for lemma, fv_s in self.lemma_fv_form_dict.items():
-
-            # for any pair of fv
-            for fv_pair in combinations(fv_s, 2):
-                fv1, fv2 = fv_pair
-                fv1, fv2 = frozenset(fv1), frozenset(fv2)
-                # if fv1 and fv2 is a minimal pair
-                if self.differ_by_one_dimension(fv1, fv2):
-                    form1 = fv_s[fv1]
-                    form2 = fv_s[fv2]
-
-                    delta = list(ndiff(form1, form2))
-                    chars_only_in_form2 = ''.join([x[2:] for x in delta if x.startswith('+')])
-                    chars_only_in_form1 = ''.join([x[2:] for x in delta if x.startswith('-')])
-                    feature1 = fv1 - fv2
-                    feature2 = fv2 - fv1
-                    # print('{}:{} \t {}: {}'.format(''.join(feature1), chars_only_in_form1, ''.join(feature2),
-                    #                                chars_only_in_form2))
-
-                    # count ++
-                    if feature1:
-                        feature_morph_dict[feature1][chars_only_in_form1] += 1
-                    if feature2:
-                        feature_morph_dict[feature2][chars_only_in_form2] += 1
-
-        self.feature_morph_count = feature_morph_dict
+        total = len(self.lemma_fv_form_dict)
+        done = 0
+        for lemma_count, counts in partials:
+            for (feature, morph), count in counts.items():
+                feature_morph_dict[self.features.decode(feature)][morph] += count
+            done += lemma_count
+            if progress:
+                print('\r{}/{} lemmas'.format(done, total), end='', file=sys.stderr)
+        if progress:
+            print(file=sys.stderr)
+        return feature_morph_dict
+
+    def minimal_pairs_pairwise(self, fv_s):
+        """Yield the minimal pairs among the feature vectors (bitmasks) of a lemma by testing every pair"""
+        for fv1, fv2 in combinations(fv_s, 2):
+            # if fv1 and fv2 is a minimal pair
+            if self.features.differ_by_one_dimension(fv1, fv2):
+                yield fv1, fv2
+
+    def minimal_pairs_indexed(self, fv_s):
+        """Same as minimal_pairs_pairwise (same pairs, in the same orientation), without testing every pair.
+        A minimal pair is either
+        - two vectors that are the same once one feature of each is blanked out: they meet in a bucket keyed by
+          the vector without that feature, and differ_by_one_dimension then checks the dimension of the two features
+        - a vector and the same vector with one or two features more: found by looking up the vector
+          without one or two of its features
+        so the number of lookups is O(k * dims^2) instead of O(k^2) for k vectors."""
+        fvs = list(fv_s)
+        order = {fv: i for i, fv in enumerate(fvs)}
+
+        candidates = set()
+        buckets = defaultdict(list)
+        for fv, i in order.items():
+            for bit in bits_of(fv):
+                blanked = fv ^ bit
+                buckets[blanked].append(i)
+                j = order.get(blanked)
+                if j is not None:
+                    candidates.add((min(i, j), max(i, j)))
+                for other in bits_of(blanked):
+                    j = order.get(blanked ^ other)
+                    if j is not None:
+                        candidates.add((min(i, j), max(i, j)))
+        for bucket in buckets.values():
+            candidates.update(combinations(bucket, 2))
+
+        for i, j in sorted(candidates):
+            if self.features.differ_by_one_dimension(fvs[i], fvs[j]):
+                yield fvs[i], fvs[j]
 
     def read_unimorph_schema(self, file):
         import csv
@@ -86,6 +212,8 @@ class Segmenter:
         self.reverse_schema['{IPFV/PFV}'] = self.schema['IPFV']
         self.reverse_schema['{IPFV/PFR}'] = self.schema['IPFV']
 
+        self.features.load_dimensions(self.reverse_schema)
+
     def in_same_dimension(self, feature1, feature2):
         return feature1 == '' or feature2 == '' or self.reverse_schema[feature1] == self.reverse_schema[feature2]
 
@@ -97,17 +225,10 @@ class Segmenter:
         V;1;SG;PRS and V;1;SG --> True
         V;1;SG;PRS and V;1;SG;PST --> True
         V;1;SG;PRS and V;1;SG;PRS --> False
-        """
 
-        # the features that is in either fv1 or fv2 but NOT both.
-        diff = fv1 ^ fv2
-        if len(diff) == 1:
-            return True
-        elif len(diff) == 2:
-            feature1, feature2 = list(diff)
-            return self.in_same_dimension(feature1, feature2)
-        else:
-            return False
+        The feature vectors can be sets of features or bitmasks of self.features.
+        """
+        return self.features.differ_by_one_dimension(self.features.encode(fv1), self.features.encode(fv2))
 
     def print_feature_morph_prob(self):
         tuple_list = []
@@ -122,20 +243,107 @@ class Segmenter:
         tuple_list = ['{},{},{}'.format(feature_set, morph, count) for feature_set, morph, count in tuple_list]
         print('\n'.join(tuple_list))
 
-    def generate_correlation(self):
-        # TODO
-        pass
+    def feature_morph_matrix(self):
+        """feature_morph_count as a sparse (coordinate) feature x morph matrix:
+        (features, morphs, row indices, column indices, counts), the last three as numpy arrays"""
+        import numpy as np
 
-    def pickle_feature_morph_prob(self):
-        import pickle
-        pickle.dump(self.feature_morph_count, file=open('minimal_pair.pickle', 'wb+'))
+        features = []
+        morph_ids = {}
+        rows = []
+        cols = []
+        counts = []
+        for feature, morph_count_dict in self.feature_morph_count.items():
+            row = len(features)
+            features.append(feature)
+            for morph, count in morph_count_dict.items():
+                rows.append(row)
+                cols.append(morph_ids.setdefault(morph, len(morph_ids)))
+                counts.append(count)
+        return (features, list(morph_ids), np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp),
+                np.array(counts, dtype=np.float64))
+
+    def generate_correlation(self, top_k=TOP_K, measure='pmi'):
+        """Score how strongly each morph is associated with each feature, and return
+        feature --> [(morph, score), ...] with the top_k morphs of every feature, best first.
+
+        measure is one of
+        - 'pmi': log(P(feature, morph) / (P(feature) P(morph)))
+        - 'probability': P(morph | feature)
+        - 'chi2': chi-square of the 2x2 contingency table of the feature and the morph
+        Only the (feature, morph) pairs that were seen are scored, as whole arrays."""
+        import numpy as np
+
+        features, morphs, rows, cols, counts = self.feature_morph_matrix()
+        if not len(counts):
+            return {}
+        total = counts.sum()
+        row_totals = np.bincount(rows, weights=counts, minlength=len(features))[rows]
+        col_totals = np.bincount(cols, weights=counts, minlength=len(morphs))[cols]
+
+        if measure == 'pmi':
+            scores = np.log(counts * total / (row_totals * col_totals))
+        elif measure == 'probability':
+            scores = counts / row_totals
+        elif measure == 'chi2':
+            # a: feature and morph, b: feature without morph, c: morph without feature, d: neither
+            b = row_totals - counts
+            c = col_totals - counts
+            d = total - row_totals - c
+            denominator = row_totals * (total - row_totals) * col_totals * (total - col_totals)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scores = np.where(denominator > 0, total * (counts * d - b * c) ** 2 / denominator, 0.0)
+        else:
+            raise ValueError('unknown measure {}'.format(measure))
+
+        # sort by feature, then by decreasing score (ties in order of appearance),
+        # and keep the first top_k of each feature
+        order = np.lexsort((cols, -scores, rows))
+        sorted_rows = rows[order]
+        row_starts = np.searchsorted(sorted_rows, sorted_rows)
+        order = order[np.arange(len(order)) - row_starts < top_k]
+
+        correlation = {feature: [] for feature in features}
+        for row, col, score in zip(rows[order].tolist(), cols[order].tolist(), scores[order].tolist()):
+            correlation[features[row]].append((morphs[col], score))
+        return correlation
+
+    def save_feature_morph_count(self, path='minimal_pair.segm'):
+        store.save_feature_morph_count(self.feature_morph_count, path)
+
+    def load_feature_morph_count(self, path='minimal_pair.segm'):
+        """Memory map a table saved by save_feature_morph_count (read-only)"""
+        self.feature_morph_count = store.FeatureMorphCount(path)
+
+
+worker_segmenter = None
+worker_use_index = True
 
-    def unpickle_feature_morph_prob(self):
-        import pickle
-        self.feature_morph_count = pickle.load(file=open('minimal_pair.pickle'))
+
+def init_worker(segmenter, use_index):
+    global worker_segmenter, worker_use_index
+    worker_segmenter = segmenter
+    worker_use_index = use_index
+
+
+def count_shard_task(shard):
+    return worker_segmenter.count_shard(shard, worker_use_index)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--shard_size', '-ss', type=int, default=SHARD_SIZE, help='number of lemmas per task')
+    parser.add_argument('--correlation', '-co', help='write the top morphs of each feature to this csv file')
+    parser.add_argument('--measure', '-m', default='pmi', choices=['pmi', 'probability', 'chi2'],
+                        help='association measure of the correlation')
+    parser.add_argument('--top_k', '-k', type=int, default=TOP_K, help='number of morphs per feature')
+    args = parser.parse_args()
+    return args
 
 
 def main():
+    args = parse_arguments()
     segmenter = Segmenter()
 
     with open('data/universal_features.csv') as file:
@@ -143,25 +351,29 @@ def main():
 
     # print(segmenter.differ_by_one_dimension(('V', 'SG', 'PRS'), ('V', 'SG', 'PST')))
 
-    with open('data/wik_tur.csv') as file:
-        data = get_unprocessed_data(file)
-
     # lemma --> fv -->form
     lemma_fv_form_dict = defaultdict(dict)
 
-    for form, lemma, fv in data:
-        feature_frozenset = frozenset(fv.split(';'))
-        lemma_fv_form_dict[lemma][feature_frozenset] = form
+    stats = ReaderStats()
+    with open('data/wik_tur.csv') as file:
+        for form, lemma, fv in iter_unprocessed_data(file, stats):
+            lemma_fv_form_dict[lemma][segmenter.features.encode(fv)] = form
+    print(stats, file=sys.stderr)
 
     segmenter.lemma_fv_form_dict = lemma_fv_form_dict
 
-    segmenter.produce_possible_morphs_from_minimal_pair()
+    segmenter.produce_possible_morphs_from_minimal_pair(jobs=args.jobs, shard_size=args.shard_size, progress=True)
 
     segmenter.print_feature_morph_prob()
 
-    segmenter.pickle_feature_morph_prob()
+    segmenter.save_feature_morph_count()
 
-    segmenter.generate_correlation()
+    if args.correlation:
+        correlation = segmenter.generate_correlation(top_k=args.top_k, measure=args.measure)
+        with open(args.correlation, 'w') as file:
+            for feature, morph_scores in sorted(correlation.items(), key=lambda item: sorted(item[0])):
+                for morph, score in morph_scores:
+                    file.write('{},{},{}\n'.format(';'.join(sorted(feature)), morph, score))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,153 @@
+"""
+Exact MLCS of any number of strings, as opposed to folding LCS pairwise
+(m_longest_common_subsequence_2/_3, starter_code.MLCS), which depends on the order of the strings
+and can miss the real MLCS because each fold step commits to one pairwise LCS.
+
+The search space is the set of "match points": a tuple of positions, one per string, reached after
+matching the same character in every string. From a point, each character leads to the leftmost
+next occurrence in every string (a successor table per form makes this a lookup), and only dominant
+successors are kept (a successor that is >= another one in every position cannot lead to a longer
+subsequence). The points are explored with A*, using the minimum of pairwise suffix LCS lengths as an
+upper bound of what can still be matched.
+
+If the search needs more than max_nodes expansions or time_budget seconds, it gives up and returns
+the result of the pairwise fold instead.
+"""
+import heapq
+import time
+
+from helper import BitParallelLCSTable
+from helper import m_longest_common_subsequence_3
+
+MAX_NODES = 20000
+TIME_BUDGET = 2.0  # seconds
+
+
+def successor_table(s, alphabet):
+    """table[i][c] is the index of the first c in s[i:], for every c in the alphabet that occurs there"""
+    table = [None] * (len(s) + 1)
+    current = {}
+    table[len(s)] = current
+    for i in range(len(s) - 1, -1, -1):
+        if s[i] in alphabet:
+            current = dict(current)
+            current[s[i]] = i
+        table[i] = current
+    return table
+
+
+class MLCSSearch:
+    """A* over the dominant match points of a list of strings"""
+
+    def __init__(self, strings):
+        # the shortest string is the reference of the pairwise bounds
+        self.strings = sorted(strings, key=len)
+        alphabet = set(self.strings[0])
+        for s in self.strings[1:]:
+            alphabet &= set(s)
+        self.alphabet = sorted(alphabet)
+        self.tables = [successor_table(s, alphabet) for s in self.strings]
+
+        ref = self.strings[0][::-1]
+        self.bound_tables = [BitParallelLCSTable(ref, s[::-1]) for s in self.strings[1:]]
+        self.lengths = [len(s) for s in self.strings]
+
+    def upper_bound(self, point):
+        """Upper bound of the MLCS length of the suffixes starting at point"""
+        n0 = self.lengths[0] - point[0]
+        h = n0
+        for table, length, p in zip(self.bound_tables, self.lengths[1:], point[1:]):
+            bound = table[n0][length - p]
+            if bound < h:
+                h = bound
+                if h == 0:
+                    break
+        return h
+
+    def successors(self, point):
+        """Dominant (char, next point) pairs"""
+        candidates = []
+        for c in self.alphabet:
+            nxt = []
+            for table, p in zip(self.tables, point):
+                index = table[p].get(c)
+                if index is None:
+                    break
+                nxt.append(index + 1)
+            else:
+                candidates.append((c, tuple(nxt)))
+
+        dominant = []
+        for c, q in candidates:
+            dominated = False
+            for d, r in candidates:
+                if r != q and all(x <= y for x, y in zip(r, q)):
+                    dominated = True
+                    break
+            if not dominated:
+                dominant.append((c, q))
+        return dominant
+
+    def search(self, max_nodes=MAX_NODES, time_budget=TIME_BUDGET):
+        """Return the MLCS, or None if the budget is exceeded"""
+        start = tuple(0 for _ in self.strings)
+        deadline = time.time() + time_budget if time_budget is not None else None
+
+        best_g = {start: 0}
+        parent = {start: None}
+        counter = 0
+        # entries: (-f, -g, counter, point, is_goal)
+        heap = [(-self.upper_bound(start), 0, counter, start, False)]
+        expanded = 0
+
+        while heap:
+            neg_f, neg_g, _, point, is_goal = heapq.heappop(heap)
+            g = -neg_g
+            if is_goal:
+                return self.path(parent, point)
+            if g < best_g[point]:  # stale entry
+                continue
+
+            expanded += 1
+            if max_nodes is not None and expanded > max_nodes:
+                return None
+            if deadline is not None and expanded % 100 == 0 and time.time() > deadline:
+                return None
+
+            successors = self.successors(point)
+            if not successors:
+                # nothing more can be matched: g is the exact value of this path
+                counter += 1
+                heapq.heappush(heap, (-g, neg_g, counter, point, True))
+                continue
+            for c, q in successors:
+                if g + 1 > best_g.get(q, -1):
+                    best_g[q] = g + 1
+                    parent[q] = (point, c)
+                    counter += 1
+                    heapq.heappush(heap, (-(g + 1 + self.upper_bound(q)), -(g + 1), counter, q, False))
+        return ''
+
+    @staticmethod
+    def path(parent, point):
+        chars = []
+        while parent[point] is not None:
+            point, c = parent[point]
+            chars.append(c)
+        return ''.join(reversed(chars))
+
+
+def MLCS(iterable, max_nodes=MAX_NODES, time_budget=TIME_BUDGET, fallback=m_longest_common_subsequence_3):
+    """Find the longest common subsequence of all strings in the iterable.
+    Falls back to `fallback` (a pairwise fold by default) when the search exceeds its budget."""
+    lst = list(iterable)
+    if not lst:
+        return ''
+    strings = sorted(set(lst))
+    if len(strings) == 1:
+        return strings[0]
+
+    lcs = MLCSSearch(strings).search(max_nodes=max_nodes, time_budget=time_budget)
+    if lcs is None:
+        return fallback(lst)
+    return lcs
@@ -0,0 +1,73 @@
+"""
+Language profiles: the language specific letters used by the scripts, read from profiles.csv.
+
+Each row of the file is language,kind,symbol,letters where kind is
+- vowels: the vowels of the language, in order (symbol is empty)
+- archiphoneme: the letters that are written as the symbol by convert_to_archiphonemic (e.g. E for a and e)
+
+The 'default' profile has the vowels that the LCS functions avoid when breaking ties.
+A profile is compiled once into a frozenset of vowels and a str.translate table, so normalizing a form is a
+single pass over it.
+"""
+import csv
+import os
+
+PROFILE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles.csv')
+
+
+class LanguageProfile:
+    def __init__(self, name):
+        self.name = name
+        # vowels in the order of the profile file, and as a set for lookups
+        self.vowel_list = []
+        self.vowels = frozenset()
+        # archiphoneme --> letters
+        self.archiphonemes = {}
+        # str.translate table: letter (code point) --> archiphoneme
+        self.archiphoneme_table = {}
+
+    def add(self, kind, symbol, letters):
+        if kind == 'vowels':
+            self.vowel_list.extend(letters)
+        elif kind == 'archiphoneme':
+            self.archiphonemes[symbol] = self.archiphonemes.get(symbol, '') + letters
+        else:
+            raise ValueError('unknown kind {} in the profile of {}'.format(kind, self.name))
+
+    def compile(self):
+        self.vowels = frozenset(self.vowel_list)
+        self.archiphoneme_table = str.maketrans({letter: symbol for symbol, letters in self.archiphonemes.items()
+                                                 for letter in letters})
+
+    def normalize_form(self, form):
+        """Replace every letter of the form by its archiphoneme"""
+        return form.translate(self.archiphoneme_table)
+
+    def normalize(self, forms):
+        """normalize_form of each form, as a list"""
+        table = self.archiphoneme_table
+        return [form.translate(table) for form in forms]
+
+
+def load_profiles(file):
+    """language --> compiled LanguageProfile"""
+    profiles = {}
+    for row in csv.DictReader(file):
+        language = row['language']
+        if language not in profiles:
+            profiles[language] = LanguageProfile(language)
+        profiles[language].add(row['kind'], row['symbol'], row['letters'])
+    for profile in profiles.values():
+        profile.compile()
+    return profiles
+
+
+# language --> LanguageProfile, read from PROFILE_FILE on first use
+PROFILES = {}
+
+
+def get_profile(language):
+    if not PROFILES:
+        with open(PROFILE_FILE, encoding='utf-8') as file:
+            PROFILES.update(load_profiles(file))
+    return PROFILES[language]
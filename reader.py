@@ -0,0 +1,83 @@
+"""
+Streaming reader of UniMorph style csv files: [inflected form],[lemma],[feature1;feature2;...]
+
+Rows are yielded one at a time (or in chunks), so that a file of any size can be processed in bounded memory,
+and the rows that are thrown away are counted by reason.
+"""
+import re
+from collections import Counter
+from itertools import islice
+
+# any inflection that contains one of these is ignored ('*' is removed instead)
+REJECTED_CHARS = re.compile(r'[ {?\-(/]')
+
+REASONS = {
+    ' ': 'space in form',
+    '{': 'brace in form',
+    '?': 'question mark in form',
+    '-': 'hyphen in form',
+    '(': 'parenthesis in form',
+    '/': 'slash in form',
+}
+
+
+class ReaderStats:
+    """How many rows were read, kept, and rejected (by reason)"""
+
+    def __init__(self):
+        self.read = 0
+        self.kept = 0
+        self.rejected = Counter()
+
+    def update(self, other):
+        self.read += other.read
+        self.kept += other.kept
+        self.rejected.update(other.rejected)
+
+    def __str__(self):
+        reasons = ', '.join('{}: {}'.format(reason, count) for reason, count in sorted(self.rejected.items()))
+        return '{} rows read, {} kept, {} rejected ({})'.format(self.read, self.kept, self.read - self.kept,
+                                                                reasons or 'none')
+
+
+def iter_unprocessed_data(file, stats=None):
+    """ Read the csv file without doing any processing of the data, one row at a time
+    Input: csv file (or any iterable of lines) formatted as [inflected form],[lemma],[feature1;feature2;...]
+    Output: tuples formatted as (inflected_form, lemma, feature_vector)
+    """
+    if stats is None:
+        stats = ReaderStats()
+    for line in file:
+        stats.read += 1
+        fields = line.strip().split(',')
+        if len(fields) != 3:
+            stats.rejected['malformed line'] += 1
+            continue
+        inflected_form, lemma, fv = fields
+
+        match = REJECTED_CHARS.search(inflected_form)
+        if match:
+            stats.rejected[REASONS[match.group()]] += 1
+            continue
+        # ignore any inflection that contains spaces
+        if ' ' in lemma:
+            stats.rejected['space in lemma'] += 1
+            continue
+
+        stats.kept += 1
+        yield inflected_form.replace('*', ''), lemma, fv
+
+
+def get_unprocessed_data(file, stats=None):
+    """Same as iter_unprocessed_data, as a list"""
+    return list(iter_unprocessed_data(file, stats))
+
+
+def chunked(iterable, size):
+    """Yield lists of (at most) size items of the iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
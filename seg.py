@@ -1,8 +1,13 @@
+import argparse
 import re
-from collections import defaultdict
+import sys
+import time
+from collections import Counter, OrderedDict, defaultdict
+from multiprocessing import Pool
 
-from feature_combo import get_unprocessed_data
-from helper import powerset
+from features import FeatureRegistry
+from helper import AhoCorasick, SubsetIndex, powerset
+from reader import ReaderStats, chunked, get_unprocessed_data
 
 BRACES = re.compile(r'[{}]')
 
@@ -10,10 +15,123 @@ BRACES = re.compile(r'[{}]')
 class Segmenter():
     """This class is used as a container of variables and methods, in order to avoid using global var"""
 
-    def __init__(self):
-        self.feature_morpheme_dict = None
+    def __init__(self, cache_size=None, features=None):
+        self._feature_morpheme_dict = None
+        self.feature_index = None
+        # feature vectors are masks of this registry
+        self.features = features if features is not None else FeatureRegistry()
+        # mask of a feature vector --> (mask of the recognized features, morphs in priority order, automaton)
+        self.compiled_groups = {}
+
+        # opt-in LRU cache of attempt_segment: (form, mask of the features) --> (segmented form, mask of features left)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def feature_morpheme_dict(self):
+        return self._feature_morpheme_dict
+
+    @feature_morpheme_dict.setter
+    def feature_morpheme_dict(self, d):
+        # the dictionary is shared with the caller, not copied
+        self._feature_morpheme_dict = d
+        self.invalidate()
+
+    def invalidate(self):
+        """Forget everything computed from feature_morpheme_dict (the morph automata and the cache).
+        Assigning feature_morpheme_dict does this; a caller that modifies the dictionary in place afterwards
+        (adds, removes or changes morphs) must call invalidate() before segmenting again."""
+        self.feature_index = None
+        self.compiled_groups = {}
+        self.cache.clear()
+
+    def cache_info(self):
+        return {'hits': self.cache_hits, 'misses': self.cache_misses, 'size': len(self.cache),
+                'maxsize': self.cache_size}
+
+    def compile_group(self, mask):
+        """Collect the morphs of every subset of the feature vector (a mask) and compile them into one automaton"""
+        if mask in self.compiled_groups:
+            return self.compiled_groups[mask]
+
+        if self.feature_index is None:
+            self.feature_index = SubsetIndex(self.feature_morpheme_dict.keys())
+
+        recognized = 0
+        morphs = set()
+        for feature_set in self.feature_index.subsets(self.features.decode(mask)):
+            recognized |= self.features.encode(feature_set)
+            morphs.update(self.feature_morpheme_dict[feature_set])
+
+        # prioritize long morphs
+        morphs = sorted(morphs, key=lambda morph: (-len(morph), morph))
+        group = (recognized, morphs, AhoCorasick(morphs))
+        self.compiled_groups[mask] = group
+        return group
 
     def attempt_segment(self, form, feature_vector):
+        """Put braces around the known morphs of the features in the form, longer morphs first.
+        Return the bracketed form and the features that have no morph in the dictionary.
+        The feature vector is a mask of self.features, 'A;B;C' or an iterable of features.
+        The results are only up to date with feature_morpheme_dict if invalidate() was called after modifying it."""
+        mask = self.features.encode(feature_vector)
+        if not self.cache_size:
+            segmented_form, left = self.segment(form, mask)
+            return segmented_form, set(self.features.decode(left))
+
+        key = (form, mask)
+        if key in self.cache:
+            self.cache_hits += 1
+            self.cache.move_to_end(key)
+            segmented_form, left = self.cache[key]
+        else:
+            self.cache_misses += 1
+            segmented_form, left = self.segment(form, mask)
+            self.cache[key] = (segmented_form, left)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return segmented_form, set(self.features.decode(left))
+
+    def segment(self, form, mask):
+        """attempt_segment without the cache, on a mask. Returns the mask of the features left"""
+        if '{' in form or '}' in form:
+            segmented_form, left = self.attempt_segment_replace(form, self.features.decode(mask))
+            return segmented_form, self.features.encode(left)
+
+        recognized, morphs, automaton = self.compile_group(mask)
+
+        # all occurrences of all morphs, in one pass over the form
+        occurrences = [[] for _ in morphs]
+        for start, end, index in automaton.finditer(form):
+            occurrences[index].append((start, end))
+
+        # each morph, in priority order, takes its leftmost non-overlapping occurrences
+        # that are not already inside the braces of a longer morph
+        taken = [False] * len(form)
+        brackets = []
+        for positions in occurrences:
+            morph_end = 0
+            for start, end in sorted(positions):
+                if start >= morph_end and not any(taken[start:end]):
+                    taken[start:end] = [True] * (end - start)
+                    brackets.append((start, end))
+                    morph_end = end
+
+        segments = []
+        prev = 0
+        for start, end in sorted(brackets):
+            segments.append(form[prev:start])
+            segments.append('{{{}}}'.format(form[start:end]))
+            prev = end
+        segments.append(form[prev:])
+
+        # remove found features from the feature vector
+        return ''.join(segments), mask & ~recognized
+
+    def attempt_segment_replace(self, form, feature_vector):
+        """Segment by replacing each morph in the parts of the form that are not inside braces yet"""
         # print(type(features))
         recognized_morph = set()
 
@@ -28,7 +146,7 @@ class Segmenter():
 
         # sort and prioritize long morphs
         recognized_morph = list(recognized_morph)
-        recognized_morph.sort(key=lambda x: len(x[1]), reverse=True)
+        recognized_morph.sort(key=lambda x: (-len(x[1]), x[1]))
         for feature_set, morph in recognized_morph:
 
             segments = BRACES.split(form)
@@ -45,27 +163,113 @@ class Segmenter():
         return form, feature_vector
 
 
-def main():
-    with open('data/wik_tur_N_only.csv', encoding='utf8') as file:
-        data = get_unprocessed_data(file)
+def read_affix_list(file):
+    """Read a [feature1;feature2;...],[morph] csv into a dictionary: frozenset of features --> list of morphs"""
+    d = defaultdict(list)
+    for line in file:
+        # print(line)
+        features, segment = line.strip().split(',')
+        if segment:
+            d[frozenset(features.split(';'))].append(segment)
+    return d
 
-    segmenter = Segmenter()
 
-    d = defaultdict(list)
-    with open('data/tur_N_affix_list.csv', encoding='utf8') as file:
-        for line in file:
-            # print(line)
-            features, segment = line.strip().split(',')
-            if segment:
-                d[frozenset(features.split(';'))].append(segment)
-    segmenter.feature_morpheme_dict = d
+# the segmenter of a worker process, built once by init_worker
+worker_segmenter = None
+
+
+def init_worker(affix_filename, cache_size=None):
+    global worker_segmenter
+    worker_segmenter = Segmenter(cache_size=cache_size)
+    with open(affix_filename, encoding='utf8') as file:
+        worker_segmenter.feature_morpheme_dict = read_affix_list(file)
+
 
+def format_feature_set(feature_set):
+    """Like str(set), but sorted so that the output does not depend on the hash seed of the process"""
+    if not feature_set:
+        return 'set()'
+    return '{{{}}}'.format(', '.join(repr(feature) for feature in sorted(feature_set)))
+
+
+def segment_chunk(lines):
+    """Segment a chunk of raw csv lines.
+    Return the reader statistics, the cache hits and misses of the chunk, and the output lines"""
+    output = []
+    stats = ReaderStats()
+    hits, misses = worker_segmenter.cache_hits, worker_segmenter.cache_misses
+    data = get_unprocessed_data(lines, stats)
     for inflected_form, lemma, features in data:
-        features = features.split(';')
+        # the mask of the feature vector, parsed once per distinct string
+        features = worker_segmenter.features.encode(features)
         inflection = inflected_form.replace(lemma, "")
 
-        segmented_form, new_feature_set = segmenter.attempt_segment(inflection, features)
-        print(inflected_form, segmented_form, lemma, new_feature_set, sep=',')
+        segmented_form, new_feature_set = worker_segmenter.attempt_segment(inflection, features)
+        output.append(','.join([inflected_form, segmented_form, lemma, format_feature_set(new_feature_set)]))
+    cache = Counter(hits=worker_segmenter.cache_hits - hits, misses=worker_segmenter.cache_misses - misses)
+    return stats, cache, output
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', '-i', help='UniMorph csv file to segment', default='data/wik_tur_N_only.csv')
+    parser.add_argument('--affixes', '-a', help='csv file of features and their morphs',
+                        default='data/tur_N_affix_list.csv')
+    parser.add_argument('--output', '-o', help='write the segmentations to this file instead of stdout')
+    parser.add_argument('--jobs', '-j', help='number of worker processes', default=1, type=int)
+    parser.add_argument('--chunk_size', '-cs', help='number of lines sent to a worker at a time', default=10000,
+                        type=int)
+    parser.add_argument('--unordered', '-u', action='store_true',
+                        help='write the chunks as soon as they are done instead of in input order')
+    parser.add_argument('--cache_size', '-c', help='remember the segmentation of this many (inflection, features)',
+                        default=0, type=int)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    start = time.time()
+
+    out = open(args.output, 'w', encoding='utf8', buffering=1 << 20) if args.output else sys.stdout
+    pool = None
+    stats = ReaderStats()
+    # cache hits and misses, summed over the chunks of all the processes
+    cache = Counter()
+    with open(args.input, encoding='utf8') as file:
+        # the workers filter the raw lines themselves
+        chunks = chunked(file, args.chunk_size)
+        if args.jobs > 1:
+            pool = Pool(args.jobs, initializer=init_worker, initargs=(args.affixes, args.cache_size))
+            if args.unordered:
+                results = pool.imap_unordered(segment_chunk, chunks)
+            else:
+                results = pool.imap(segment_chunk, chunks)
+        else:
+            init_worker(args.affixes, args.cache_size)
+            results = map(segment_chunk, chunks)
+
+        for chunk_stats, chunk_cache, lines in results:
+            stats.update(chunk_stats)
+            cache.update(chunk_cache)
+            if lines:
+                out.write('\n'.join(lines))
+                out.write('\n')
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if out is not sys.stdout:
+        out.close()
+
+    if args.cache_size:
+        print('cache: {} hits, {} misses, {} entries per process'.format(cache['hits'], cache['misses'],
+                                                                          args.cache_size), file=sys.stderr)
+    elapsed = time.time() - start
+    row_count = stats.kept
+    print(stats, file=sys.stderr)
+    rate = row_count / elapsed if elapsed else 0
+    print('{} rows in {:.2f}s ({:.0f} rows/sec, {} jobs)'.format(row_count, elapsed, rate, args.jobs), file=sys.stderr)
 
 
 if __name__ == '__main__':
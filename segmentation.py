@@ -1,29 +1,26 @@
-from collections import defaultdict
-
-import re
+from collections import Counter, defaultdict
+from itertools import groupby
+from operator import itemgetter
 
+from features import FEATURES
+from profiles import get_profile
+from reader import get_unprocessed_data, iter_unprocessed_data
 from starter_code import LCS, MLCS, compare_str_lcs
+import argparse
 import codecs
 
 
-def get_unprocessed_data(file):
-    lst = []
-    for line in file:
-        inflected_form, lemma, fv = line.split(',')
-        # ignore any inflection that contains spaces
-        if ' ' in inflected_form or ' ' in lemma or '{' in inflected_form or '?' in inflected_form or '-' in inflected_form:
-            continue
-
-        inflected_form = inflected_form.replace('*', '')
-
-        if '(' in inflected_form or '/' in inflected_form:
-            continue
+def get_mlcs(exact=False):
+    """The exact MLCS of all the strings (mlcs.MLCS) with exact, otherwise the pairwise fold"""
+    if exact:
+        from mlcs import MLCS as mlcs
+        return mlcs
+    return MLCS
 
-        lst.append((inflected_form, lemma, fv))
-    return lst
 
-
-def produce_dicts(file):
+def produce_dicts(file, exact=False):
+    """With exact, the stem of a lemma is the exact MLCS of its forms instead of the pairwise fold"""
+    mlcs = get_mlcs(exact)
     tup_list = get_unprocessed_data(file)
 
     # dict[lemma] == [form1, form2, ...]
@@ -34,86 +31,82 @@ def produce_dicts(file):
     # dict[lemma] == lcs_of_all_its_forms
     lemma_lcs_dict = {}
     for word, forms in lemma_forms_dict.items():
-        lemma_lcs_dict[word] = MLCS(forms)
+        lemma_lcs_dict[word] = mlcs(forms)
 
     # dict[feature][stem] == [form1, form2, ...]
     feature_dict = defaultdict(lambda: defaultdict(list))
 
     for inflected_form, lemma, fv in tup_list:
         stem = lemma_lcs_dict[lemma]
-        for feature in fv.strip().split(';'):
+        for feature in FEATURES.split(fv):
             feature_dict[feature][stem].append(inflected_form)
     return feature_dict, lemma_forms_dict
 
 
-def convert_to_archiphonemic(form):
-    # language specific
-    form = re.sub('[ae]', 'E', form)
-    form = re.sub('[iɪüu]', 'I', form)
-    form = re.sub('[dt]', 'D', form)
-    form = re.sub('[cç]', 'C', form)
-    form = re.sub('[kgǧ]', 'K', form)
-    return form
+def convert_to_archiphonemic(form, profile=None):
+    # language specific: the archiphonemes are in profiles.csv (Turkish by default)
+    return (profile or get_profile('tur')).normalize_form(form)
+
+
+def iter_lemma_groups(tuples):
+    """Yield (lemma, rows of the lemma) from (inflected_form, lemma, feature_vector) rows.
+    The rows of a lemma must be contiguous, as they are in the UniMorph files, so that only one lemma is held at a time.
+    The names of the lemmas already seen are kept to check this (a set of strings, far smaller than the rows).
+    """
+    finished = set()
+    for lemma, rows in groupby(tuples, key=itemgetter(1)):
+        if lemma in finished:
+            raise ValueError('the rows of lemma {} are not contiguous, sort the file by lemma'.format(lemma))
+        finished.add(lemma)
+        yield lemma, list(rows)
+
+
+def count_feature_endings(tuples, exact=False):
+    """(feature, ending) --> frequency in one pass over the rows.
+    The ending of a form is what follows the MLCS of all the forms of its lemma (the stem), exact or folded."""
+    mlcs = get_mlcs(exact)
+    counts = Counter()
+    for lemma, rows in iter_lemma_groups(tuples):
+        stem = mlcs([inflected_form for inflected_form, _, _ in rows])
+        for inflected_form, _, fv in rows:
+            # TAG -> ending -> frequency
+            suffix = inflected_form[len(stem):]
+            for feature in FEATURES.split(fv):
+                counts[feature, suffix] += 1
+    return counts
 
 
-def read_csv(filename):
-    final_freq_dict = defaultdict(int)
-    fout = codecs.open("Tag_endings_freq.csv", 'wb', encoding='utf-8')
-    fout.write("Feature_Tag,Ending,Frequency" + "\n")
+def read_csv(filename, exact=False):
     with open(filename, encoding='utf-8') as file:
-        feature_lemma_forms_dict, lemma_forms_dict = produce_dicts(file)
-    # print(feature_lemma_forms_dict['N'])
-    for feature, lemmas in feature_lemma_forms_dict.items():
-        # all the features are the N, V and a list so on.
-        # lemmas are a list with lemmas and endings
-        all_forms = set()  # all words with this feature
-        for lemma, forms in lemmas.items():
-            for form in forms:
-                # take every word here in the set which has an inflection
-                suffix = form[len(lemma):]
-
-                # TAG -> ending -> frequency
-                # feature -> affix -> frequency yet to cal.
-                final_freq_dict[(suffix, feature)] += 1
-                # fout.write(feature+","+affix+"\n")
-    lst = []
-
-    lcs_dict = {}
-    # this dict is used as a bag to store the feature and the lcs over the affixes associated with the feature.
+        final_freq_dict = count_feature_endings(iter_unprocessed_data(file), exact)
+
+    # sort by feature and then by freq
+    lst = sorted(final_freq_dict.items(), key=lambda item: (item[0][0], -item[1], item[0][1]))
+    with codecs.open("Tag_endings_freq.csv", 'wb', encoding='utf-8') as fout:
+        fout.write("Feature_Tag,Ending,Frequency" + "\n")
+        fout.write('\n'.join('{},{},{}'.format(feature, suffix, count) for (feature, suffix), count in lst))
 
-    for (suffix, feature), count in final_freq_dict.items():
-        if feature in lcs_dict:
-            lcs_dict[feature].append(suffix)
-        else:
-            lcs_dict[feature] = [suffix]
-        # fout.write(feature+","+suffix+","+str(count)+"\n")
-        tup = (feature, suffix, str(count))
-        lst.append(tup)
-    lst = sorted(lst, key=lambda x: int(x[2]), reverse=True)
-    lst = sorted(lst, key=lambda x: x[0])
-    lst = [','.join(tup) for tup in lst]
-    fout.write('\n'.join(lst))
+    # this dict is used as a bag to store the feature and the lcs over the affixes associated with the feature.
+    lcs_dict = defaultdict(list)
+    for feature, suffix in final_freq_dict:
+        lcs_dict[feature].append(suffix)
 
     for features, affix in lcs_dict.items():
         lcs_temp = MLCS(affix)
         print(features+" "+lcs_temp)
 
 
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--exact', '-ex', action='store_true',
+                        help='use the exact MLCS of the forms of a lemma as its stem instead of folding pairwise')
 
-            #fout.write(feature+","+)
-            # lemma is the key word
-            #all_forms.update(forms)
-            # lcs = MLCS(all_forms)
-            # chop lemma from all the forms.
-            # store this as an entire file like this.
-            # TAG -> ending -> frequency
-
-            #print(forms)
-            #print('{}'.format(feature))
+    return parser.parse_args()
 
 
 def main():
-    read_csv('wik_tur.csv')
+    args = parse_arguments()
+    read_csv('wik_tur.csv', args.exact)
 
 
 if __name__ == '__main__':
@@ -6,9 +6,29 @@ This file contains code to use functions based on longest common subsequence (LC
 Based on these affixes and average word length, a scaling co-efficient for use with
 a position-weighted Levenshtein distance algorithm is calculated.
 """
+from collections import defaultdict as dd
+from multiprocessing import Pool
 
+import helper
+import store
 
-def LCS(X, Y):
+# compile_paradigm_list: lemmas per task, and seconds between checkpoints
+SHARD_SIZE = 100
+CHECKPOINT_INTERVAL = 600
+
+
+def LCS(X, Y, vowels=helper.VOWELS):
+    """
+    Dispatches to the LCS engine selected in helper.LCS_BACKEND. The bit-parallel engine gives the same result as
+    LCS_dp (same consonant bias in ties) but keeps each row of the table as a single integer.
+    vowels is the set of vowels avoided when breaking ties (the default profile of profiles.csv).
+    """
+    if helper.LCS_BACKEND == 'bitparallel':
+        return helper.LCS_bitparallel(X, Y, vowels)
+    return LCS_dp(X, Y, vowels)
+
+
+def LCS_dp(X, Y, vowels=helper.VOWELS):
     """
     First finds a table (matrix) such that L[j][k] is length of longest common subsequence for X[0:j] and Y[0:k].
     Then, uses tracebacks through this table to print the actual LCS.
@@ -36,10 +56,10 @@ def LCS(X, Y):
             k -= 1
         elif L[j - 1][k] == L[j][k - 1]:  # Original algorithm didn't adequately deal with case in which
             # cell to the left or above were equally good.
-            if X[j - 2] == Y[k - 1] and X[j - 2] not in {"a", "e", "i", "o", "u"}:  # Bias toward consonants in stem.
-                j -= 1  # Eventually, need to not hardcode the vowels!!
-            elif X[j - 1] == Y[k - 2] and Y[k - 2] not in {"a", "e", "i", "o", "u"}:  # Bias toward consonants in stem.
-                k -= 1  # Eventually, need to not hardcode the vowels!!
+            if X[j - 2] == Y[k - 1] and X[j - 2] not in vowels:  # Bias toward consonants in stem.
+                j -= 1
+            elif X[j - 1] == Y[k - 2] and Y[k - 2] not in vowels:  # Bias toward consonants in stem.
+                k -= 1
             else:  # Default directionality: Leftward in chart.
                 k -= 1
         else:  # Default directionality: Leftward in chart.
@@ -190,6 +210,55 @@ def find_lcs_seg(word, word_pos, lcs_segments, lcs_seg_pos):
                                     lcs_seg_pos)  # Calls the function again for recursion.
 
 
+class LCSSegmentLocator:
+    """
+    Finds where the LCS of a cluster is in a word: the same lcs_seg_pos as find_lcs_seg(word, 0, segment_lcs(lcs)[0], [])
+    but without generating the segmentations of the LCS. At each step, find_lcs_seg takes the first segmentation that
+    is in the rest of the word, i.e. the longest segment at the smallest start in the LCS. With a suffix automaton
+    of the word, and the last end of each of its states, that longest segment is one walk through the automaton.
+    """
+
+    def __init__(self, word):
+        self.word = word
+        self.automaton = helper.SuffixAutomaton([word])
+        self.last_end = self.automaton.last_ends()
+        # character --> its last index in the word
+        self.last_index = {c: i for i, c in enumerate(word)}
+
+    def longest_segment(self, lcs, i, word_pos):
+        """Length of the longest prefix of lcs[i:] that is in the word at or after word_pos"""
+        transitions = self.automaton.next
+        state = 0
+        length = 0
+        for c in lcs[i:]:
+            state = transitions[state].get(c)
+            # the segment (length + 1 characters) starts at or after word_pos in its last occurrence
+            if state is None or self.last_end[state] - length - 1 < word_pos:
+                break
+            length += 1
+        return length
+
+    def locate(self, lcs):
+        """List of (segment of the LCS, where it starts in the word, where it ends in the word), or None like
+        find_lcs_seg if part of the LCS can't be placed"""
+        if not lcs:
+            return None
+        lcs_seg_pos = []
+        word_pos = 0
+        while lcs:
+            for i, c in enumerate(lcs):
+                if self.last_index.get(c, -1) >= word_pos:
+                    break
+            else:  # no segment of the LCS is in the rest of the word
+                return None
+            seg = lcs[i:i + self.longest_segment(lcs, i, word_pos)]
+            seg_start = self.word.find(seg, word_pos)
+            word_pos = seg_start + len(seg)
+            lcs_seg_pos.append((seg, seg_start, word_pos))
+            lcs = lcs[lcs.find(seg) + len(seg):]  # Same as find_lcs_seg: the LCS from the segment to the end.
+        return lcs_seg_pos
+
+
 def find_infl(word, lcs_seg_pos):
     """
     This finds material in a word that is not the LCS. The name of the function reflects a view in which the LCS is 
@@ -275,7 +344,7 @@ def template_gen(s, template_dict_by_fv=0):
     s_words = set([x for (x, y) in s])  # Turn s into a set already if it isn't one in order to remove duplicates.
     template = dict()  # TODO: Check if this can be removed.
     lcs = MLCS(s_words)  # First, find the LCS. TODO HERE: Make sure that input to MLCS is just words, not tuples.
-    lcs_segments, lcs_seg_ind = segment_lcs(lcs)
+    lcs_seg_ind = segment_lcs(lcs)[1]  # Where each segment of the LCS is in the LCS, for templ_aug.
     if template_dict_by_fv == 0:
         template_dict_by_fv = defaultdict(list)  # Store all templates in here, in the form of (feat_vec, template)
     template_list = list()  # Keep two templates in here: An aggregate template and the previous template
@@ -287,8 +356,7 @@ def template_gen(s, template_dict_by_fv=0):
                 temporary_template[i] = template_list[0][i] | template_list[1][i]
             template_list = [
                 temporary_template]  # Then, replace the whole list with the temporary template as the only item
-        word_pos = 0  # Keep track of where we are in the word.
-        lcs_seg_pos = find_lcs_seg(word, word_pos, lcs_segments, [])  # Find where the LCS occurs in the word.
+        lcs_seg_pos = LCSSegmentLocator(word).locate(lcs)  # Find where the LCS occurs in the word.
         infl_pos = find_infl(word, lcs_seg_pos)  # Use that to find where the INFL material occurs.
         template = templ_aug(lcs, lcs_seg_ind, lcs_seg_pos, infl_pos)  # Then, build a template using that information.
         # WORK HERE - Need to get every set([]) inside a template to be a frozenset([]) so that we can remove duplicate templates.
@@ -372,94 +440,180 @@ def get_morph_data_no_spaces(data_file):
     return data
 
 
-def compile_paradigm_list(data):
+def paradigm_signature(chg_set):
+    """
+    A hashable signature of a paradigm (a dict of ft_vec --> (prefix, infixes, suffix)). Two paradigms have the
+    same signature exactly when they are equal, so paradigms can be deduplicated with a dict.
+    """
+    return frozenset(chg_set.items())
+
+
+def lemma_paradigm(lemma_forms):
+    """
+    The paradigm of a lemma, given as a dict of ft_vec --> inflected form: a dict of ft_vec --> changes from the
+    LCS of all the forms (see compare_str_lcs). None if the forms have nothing in common.
+    """
+    # Need to calculate the LCS for the entire lemma's paradigm. Watch out for it returning as 0.
+    infl_group = set()
+    for ft_vec in lemma_forms:
+        infl_group.add(lemma_forms[ft_vec])
+    mlcs = MLCS(infl_group)
+    if len(mlcs) == 0:
+        return None
+    # Need a dict that, for each lemma, keeps an (infl, ftvec) tuple as key, then keeps dicts with "target" ftvec as 
+    # key and set_of_changes to reach it as values. 
+    # e.g. dd[(u"abacoro", u"IND;V;PRS;1;SG;IPFV/PFV")][u"IND;V;PRS;2;SG;IPFV/PFV"] = frozenset(["o","as"])
+    chg_set = dd(dict)
+    for ft_vec in lemma_forms.keys():  # originally used it.permutations - I think we
+        # can use combinations instead because the number of changes from one infl form to another is the same
+        # regardless of direction, and the changes themselves are also the same, except for the artificial designation
+        # of infixes as infixes to the source or target.
+        changes = compare_str_lcs(lemma_forms[ft_vec], mlcs)
+        chg_set[ft_vec] = changes
+        # e.g. chg_set[u'V.PTCP;PST;FEM;SG'] = 
+        #               (('p', ''),
+        #                frozenset(('i', u'ue')), 
+        #                ('s', u'da'),
+        #               )
+    return chg_set
+
+
+def paradigm_task(shard):
+    """lemma_paradigm of each (lemma, ft_vec --> form dict) of a shard of lemmas"""
+    return [(lemma, lemma_paradigm(lemma_forms)) for lemma, lemma_forms in shard]
+
+
+class ParadigmCollector:
+    """
+    The distinct paradigms found by compile_paradigm_list so far, in order of first appearance, with
+    lemma_to_paradigm (index in paradigm_list --> set of lemmas), and how many of the sorted lemmas are done.
+    """
+
+    def __init__(self):
+        self.paradigm_list = list()
+        # paradigm signature --> index in paradigm_list
+        self.paradigm_index = dict()
+        self.lemma_to_paradigm = dd(set)
+        self.lemmas_done = 0
+        self.last_lemma = None
+
+    def add(self, lemma, chg_set):
+        self.lemmas_done += 1
+        self.last_lemma = lemma
+        if chg_set is None:
+            return
+        # Look the paradigm up by its signature instead of comparing it with every paradigm in the list
+        signature = paradigm_signature(chg_set)
+        index = self.paradigm_index.get(signature)
+        if index is None:
+            index = len(self.paradigm_list)
+            self.paradigm_index[signature] = index
+            self.paradigm_list.append(chg_set)
+        self.lemma_to_paradigm[index].add(lemma)
+
+    def save_checkpoint(self, path):
+        store.save_paradigm_checkpoint(self.paradigm_list, self.lemma_to_paradigm, self.lemmas_done,
+                                       self.last_lemma, path)
+
+    @classmethod
+    def load_checkpoint(cls, path):
+        collector = cls()
+        (collector.paradigm_list, collector.lemma_to_paradigm, collector.lemmas_done,
+         collector.last_lemma) = store.load_paradigm_checkpoint(path)
+        collector.paradigm_index = {paradigm_signature(paradigm): index
+                                    for index, paradigm in enumerate(collector.paradigm_list)}
+        return collector
+
+
+def compile_paradigm_list(data, jobs=1, shard_size=SHARD_SIZE, checkpoint=None,
+                          checkpoint_interval=CHECKPOINT_INTERVAL, with_lemmas=False):
     """
     This function is the heart of the process of finding affixes based on training data.
     For a given lemma, it finds the LCS among all possible forms, then creates a dict of
     affixes used for each feature vector in each lemma, based on differences from the LCS.
-    It stores all these dicts in a paradigm_list, and keeps track of which lemmas belong to
-    which paradigms (although that information isn't currently used). It also keeps track
-    of what the LCS for each lemma's paradigm is (although this also isn't currently used.)
+    It stores all these dicts in a paradigm_list (once each, in order of first appearance), and keeps track of
+    which lemmas belong to which paradigms in lemma_to_paradigm (index in paradigm_list --> set of lemmas),
+    so the frequency of a paradigm is the number of its lemmas.
     This function produces the data structure used to gather prefixes, infixes, and suffixes
     to calculate the weighting coefficients for the position-weighted Levenshtein distance
     algorithm.
+
+    The sorted lemmas are processed in shards of shard_size lemmas by jobs processes, and merged in order, so the
+    result does not depend on jobs. With a checkpoint path, the progress is saved there every checkpoint_interval
+    seconds (and at the end), and a run with an existing checkpoint resumes after the lemmas it contains.
+    Returns paradigm_list, or (paradigm_list, lemma_to_paradigm) with with_lemmas (see paradigm_frequencies).
     """
+    import os
     import time
-    start = time.clock()
-    print("Starting time:", start)
-    current_paradigm_list_index = 0
-    paradigm_list = list()
-    #    lemma_to_paradigm = dd(set)
-    #    lemma_to_mlcs = dict()
-    for i, lemma in enumerate(sorted(data)):
-        # Just to give you something to look at while it runs...
-        if i % 300 == 0:
-            print("Index in data:", i, "\tLemma:", lemma, "\tTime at processing:", time.clock())
-            print("\tCurrent number of separate paradigms:", len(paradigm_list))
-        # Need to calculate the LCS for the entire lemma's paradigm. Watch out for it returning as 0.
-        infl_group = set()
-        for ft_vec in data[lemma]:
-            infl_group.add(data[lemma][ft_vec])
-        mlcs = MLCS(infl_group)
-        #        lemma_to_mlcs[lemma] = mlcs
-        if len(mlcs) == 0:
-            continue
-        # Need a dict that, for each lemma, keeps an (infl, ftvec) tuple as key, then keeps dicts with "target" ftvec as 
-        # key and set_of_changes to reach it as values. 
-        # e.g. dd[(u"abacoro", u"IND;V;PRS;1;SG;IPFV/PFV")][u"IND;V;PRS;2;SG;IPFV/PFV"] = frozenset(["o","as"])
-        chg_set = dd(dict)
-        for ft_vec in data[lemma].keys():  # originally used it.permutations - I think we
-            # can use combinations instead because the number of changes from one infl form to another is the same
-            # regardless of direction, and the changes themselves are also the same, except for the artificial designation
-            # of infixes as infixes to the source or target.
-            changes = compare_str_lcs(data[lemma][ft_vec], mlcs)
-            chg_set[ft_vec] = changes
-            # e.g. chg_set[u'V.PTCP;PST;FEM;SG'] = 
-            #               (('p', ''),
-            #                frozenset(('i', u'ue')), 
-            #                ('s', u'da'),
-            #               )
-        # NO INDICATION OF FREQUENCY... TRY TO REDO THINGS TO MAKE THIS WHOLE PROCESS FASTER AND KEEP FREQUENCY!
-        if chg_set not in paradigm_list:
-            paradigm_list.append(chg_set)
-        #        if chg_set in paradigm_list:
-        #            lemma_to_paradigm[paradigm_list.index(chg_set)].add(lemma)
-        #        else:
-        #            paradigm_list.append(chg_set)
-        #            lemma_to_paradigm[paradigm_list.index(chg_set)].add(lemma)
-    print("Final number of separate paradigms:", len(paradigm_list))
-    end = time.clock()
+    start = time.time()
+    print("Starting time:", time.ctime(start))
+    lemmas = sorted(data)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        collector = ParadigmCollector.load_checkpoint(checkpoint)
+        done = collector.lemmas_done
+        if done > len(lemmas) or (done and lemmas[done - 1] != collector.last_lemma):
+            raise ValueError("The checkpoint {} was not made from this data".format(checkpoint))
+        print("Resuming from", checkpoint, "after", done, "lemmas")
+    else:
+        collector = ParadigmCollector()
+    shards = ([(lemma, data[lemma]) for lemma in lemmas[i:i + shard_size]]
+              for i in range(collector.lemmas_done, len(lemmas), shard_size))
+
+    def collect(results):
+        last_checkpoint = time.time()
+        for shard_result in results:
+            for lemma, chg_set in shard_result:
+                # Just to give you something to look at while it runs...
+                if collector.lemmas_done % 300 == 0:
+                    print("Index in data:", collector.lemmas_done, "\tLemma:", lemma,
+                          "\tTime at processing:", time.time() - start)
+                    print("\tCurrent number of separate paradigms:", len(collector.paradigm_list))
+                collector.add(lemma, chg_set)
+            if checkpoint is not None and time.time() - last_checkpoint >= checkpoint_interval:
+                collector.save_checkpoint(checkpoint)
+                last_checkpoint = time.time()
+
+    if jobs > 1:
+        with Pool(jobs) as pool:
+            collect(pool.imap(paradigm_task, shards))
+    else:
+        collect(map(paradigm_task, shards))
+    if checkpoint is not None:
+        collector.save_checkpoint(checkpoint)
+
+    print("Final number of separate paradigms:", len(collector.paradigm_list))
+    end = time.time()
     print("This whole thing took", end - start, "seconds")
-    return paradigm_list  # , lemma_to_paradigm, lemma_to_mlcs
+    if with_lemmas:
+        return collector.paradigm_list, collector.lemma_to_paradigm
+    return collector.paradigm_list  # , lemma_to_mlcs
+
 
+def paradigm_frequencies(paradigm_list, lemma_to_paradigm):
+    """(paradigm, number of lemmas, lemmas) for each paradigm, most frequent first.
+    The arguments are what compile_paradigm_list(..., with_lemmas=True) returns."""
+    frequencies = [(paradigm, len(lemma_to_paradigm[index]), lemma_to_paradigm[index])
+                   for index, paradigm in enumerate(paradigm_list)]
+    frequencies.sort(key=lambda entry: entry[1], reverse=True)
+    return frequencies
 
-def pickleParadigmList(paradigm_list, data_dir):  # lemma_to_paradigm,lemma_to_mlcs):
+
+def saveParadigmList(paradigm_list, data_dir):  # lemma_to_paradigm,lemma_to_mlcs):
     """
     Because the calculation of full affix sets can take a long time, this function
     allows you to save the resulting data structures in files that can be directly 
-    loaded for later use. 
+    loaded for later use. The file is a compact binary model (see store.py).
     """
-    with open(data_dir + "paradigm_list.pickle", "wb") as f:
-        import pickle
-        pickle.dump(paradigm_list, f)
-    print("Pickled the paradigm_list")
-
+    store.save_paradigm_list(paradigm_list, data_dir + "paradigm_list.segm")
+    print("Saved the paradigm_list")
 
-#    with open("lemma_to_paradigm.pickle","wb") as f:
-#        pickle.dump(lemma_to_paradigm,f)
-#    print "Pickled the lemma_to_paradigm assignments"
-#    with open("lemma_to_mlcs.pickle","wb") as f:
-#        pickle.dump(lemma_to_mlcs,f)
-#    print "Pickled the lemma_to_paradigm assignments"
 
-def loadPickledParadigmList(para_file):  # ,lem_file):
+def loadParadigmList(para_file):
     """
-    This function loads saved data structures from the function pickleParadigmList.
+    This function loads saved data structures from the function saveParadigmList.
+    The file is memory mapped and each paradigm is only decoded when it is accessed.
     """
-    import pickle
-    paradigm_list = pickle.load(open(para_file, "rb"))
-    #    lemma_to_paradigm = pickle.load(open(lem_file,"rb"))
-    return paradigm_list  # , lemma_to_paradigm
+    return store.ParadigmList(para_file)
 
 
 def gather_affixes(paradigm_list):
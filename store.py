@@ -0,0 +1,287 @@
+"""
+Compact, versioned binary files for the models, instead of pickles.
+
+A file is a header followed by sections. Every string (feature, morph, affix...) is stored once in a string table
+and everything else is arrays of unsigned 32 bit integers that refer to it. Loading maps the file in memory and
+reads the arrays in place, so opening a model costs nothing until an entry is looked at, and no code is executed
+from the file (unlike unpickling).
+
+Layout:
+    header: magic 'SEGM', format version (uint16), kind (uint16), byte order (uint8), padding, number of sections
+    section: byte length (uint64) then the bytes, padded to a multiple of 8
+    sections 0 and 1 are the string table: the offsets of the strings (uint32) and the utf-8 bytes
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections import defaultdict
+
+MAGIC = b'SEGM'
+VERSION = 1
+HEADER = struct.Struct('<4sHHB3xI')
+SECTION_LENGTH = struct.Struct('<Q')
+
+KIND_FEATURE_MORPH_COUNT = 1
+KIND_PARADIGM_LIST = 2
+KIND_PARADIGM_CHECKPOINT = 3
+
+BYTE_ORDERS = {'little': 0, 'big': 1}
+
+
+class StoreError(Exception):
+    pass
+
+
+class StringTable:
+    """Builds the string table: every distinct string gets an id"""
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def add(self, string):
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.ids[string] = string_id
+            self.strings.append(string)
+        return string_id
+
+    def sections(self):
+        offsets = array('I', [0])
+        blob = bytearray()
+        for string in self.strings:
+            blob += string.encode('utf8')
+            offsets.append(len(blob))
+        return [offsets, bytes(blob)]
+
+
+class Strings:
+    """The string table of a loaded file, decoded on access"""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+        self.decoded = {}
+
+    def __getitem__(self, string_id):
+        string = self.decoded.get(string_id)
+        if string is None:
+            string = bytes(self.blob[self.offsets[string_id]:self.offsets[string_id + 1]]).decode('utf8')
+            self.decoded[string_id] = string
+        return string
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+def write_store(path, kind, strings, sections):
+    """Write a string table and a list of array('I') (or bytes) sections"""
+    sections = strings.sections() + list(sections)
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, kind, BYTE_ORDERS[sys.byteorder], len(sections)))
+        for section in sections:
+            data = section.tobytes() if isinstance(section, array) else bytes(section)
+            file.write(SECTION_LENGTH.pack(len(data)))
+            file.write(data)
+            file.write(b'\0' * (-len(data) % 8))
+
+
+class Store:
+    """A file written by write_store, memory mapped. sections[i] are uint32 memoryviews (except the string bytes)."""
+
+    def __init__(self, path, kind):
+        with open(path, 'rb') as file:
+            # mmap cannot map an empty file, and a truncated one has no complete header
+            if os.fstat(file.fileno()).st_size < HEADER.size:
+                raise StoreError('{} is not a model file (too short)'.format(path))
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.mmap)
+        magic, version, file_kind, byte_order, section_count = HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise StoreError('{} is not a model file'.format(path))
+        if version != VERSION:
+            raise StoreError('{} has format version {}, expected {}'.format(path, version, VERSION))
+        if file_kind != kind:
+            raise StoreError('{} contains kind {}, expected {}'.format(path, file_kind, kind))
+        swap = byte_order != BYTE_ORDERS[sys.byteorder]
+
+        self.sections = []
+        position = HEADER.size
+        for i in range(section_count):
+            if position + SECTION_LENGTH.size > len(view):
+                raise StoreError('{} is truncated'.format(path))
+            length, = SECTION_LENGTH.unpack_from(view, position)
+            position += SECTION_LENGTH.size
+            if position + length > len(view) or (i != 1 and length % 4):
+                raise StoreError('{} is truncated'.format(path))
+            data = view[position:position + length]
+            position += length + (-length % 8)
+            if i == 1:  # the string bytes
+                self.sections.append(data)
+            elif swap:
+                integers = array('I', bytes(data))
+                integers.byteswap()
+                self.sections.append(integers)
+            else:
+                self.sections.append(data.cast('I'))
+        if len(self.sections) < 2:
+            raise StoreError('{} has no string table'.format(path))
+        self.strings = Strings(self.sections[0], self.sections[1])
+
+
+# feature --> morph --> count
+
+
+def save_feature_morph_count(feature_morph_count, path):
+    """Sections: feature set offsets, feature set members (string ids), and sorted (feature set, morph, count)"""
+    strings = StringTable()
+    set_offsets = array('I', [0])
+    set_members = array('I')
+    entries = []
+    for set_id, (feature_set, morph_count) in enumerate(
+            sorted(feature_morph_count.items(), key=lambda item: sorted(item[0]))):
+        set_members.extend(sorted(strings.add(feature) for feature in feature_set))
+        set_offsets.append(len(set_members))
+        for morph, count in morph_count.items():
+            entries.append((set_id, strings.add(morph), count))
+    triples = array('I')
+    for entry in sorted(entries):
+        triples.extend(entry)
+    write_store(path, KIND_FEATURE_MORPH_COUNT, strings, [set_offsets, set_members, triples])
+
+
+class FeatureMorphCount:
+    """Read-only feature --> morph --> count table backed by a memory mapped file"""
+
+    def __init__(self, path):
+        self.store = Store(path, KIND_FEATURE_MORPH_COUNT)
+        self.set_offsets, self.set_members, self.triples = self.store.sections[2:5]
+        self.set_ids = None
+
+    def feature_set(self, set_id):
+        members = self.set_members[self.set_offsets[set_id]:self.set_offsets[set_id + 1]]
+        return frozenset(self.store.strings[string_id] for string_id in members)
+
+    def morph_counts(self, set_id):
+        """morph --> count of a feature set id (binary search in the sorted triples)"""
+        lo, hi = 0, len(self.triples) // 3
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.triples[3 * mid] < set_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        morph_count = {}
+        while 3 * lo < len(self.triples) and self.triples[3 * lo] == set_id:
+            morph_count[self.store.strings[self.triples[3 * lo + 1]]] = self.triples[3 * lo + 2]
+            lo += 1
+        return morph_count
+
+    def __len__(self):
+        return len(self.set_offsets) - 1
+
+    def __iter__(self):
+        return (self.feature_set(set_id) for set_id in range(len(self)))
+
+    def __getitem__(self, feature_set):
+        if self.set_ids is None:
+            self.set_ids = {self.feature_set(set_id): set_id for set_id in range(len(self))}
+        return self.morph_counts(self.set_ids[frozenset(feature_set)])
+
+    def items(self):
+        return ((self.feature_set(set_id), self.morph_counts(set_id)) for set_id in range(len(self)))
+
+    def to_dict(self):
+        """The same nested defaultdict as minimal_pair.Segmenter.feature_morph_count"""
+        d = defaultdict(lambda: defaultdict(int))
+        for feature_set, morph_count in self.items():
+            d[feature_set].update(morph_count)
+        return d
+
+
+# paradigm list: list of {feature vector: (prefix, frozenset of (infix, position), suffix)}
+
+
+def paradigm_list_sections(paradigm_list, strings):
+    """Sections: paradigm offsets (in entries), entries (feature vector, prefix, suffix, first infix, infix count)
+    and infixes (string, position)"""
+    paradigm_offsets = array('I', [0])
+    entries = array('I')
+    infixes = array('I')
+    for paradigm in paradigm_list:
+        for ft_vec, (prefix, infix_set, suffix) in paradigm.items():
+            first_infix = len(infixes) // 2
+            for infix, position in sorted(infix_set):
+                infixes.extend((strings.add(infix), position))
+            entries.extend((strings.add(ft_vec), strings.add(prefix), strings.add(suffix), first_infix,
+                            len(infix_set)))
+        paradigm_offsets.append(len(entries) // 5)
+    return [paradigm_offsets, entries, infixes]
+
+
+def save_paradigm_list(paradigm_list, path):
+    strings = StringTable()
+    write_store(path, KIND_PARADIGM_LIST, strings, paradigm_list_sections(paradigm_list, strings))
+
+
+class ParadigmList:
+    """Read-only list of paradigms backed by a memory mapped file. Paradigms are decoded when accessed."""
+
+    def __init__(self, path, kind=KIND_PARADIGM_LIST):
+        self.store = Store(path, kind)
+        self.paradigm_offsets, self.entries, self.infixes = self.store.sections[2:5]
+
+    def __len__(self):
+        return len(self.paradigm_offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        strings = self.store.strings
+        paradigm = defaultdict(dict)
+        for entry in range(self.paradigm_offsets[index], self.paradigm_offsets[index + 1]):
+            ft_vec, prefix, suffix, first_infix, infix_count = self.entries[5 * entry:5 * entry + 5]
+            infix_set = frozenset((strings[self.infixes[2 * i]], self.infixes[2 * i + 1])
+                                  for i in range(first_infix, first_infix + infix_count))
+            paradigm[strings[ft_vec]] = (strings[prefix], infix_set, strings[suffix])
+        return paradigm
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def to_list(self):
+        return list(self)
+
+
+# checkpoint of starter_code.compile_paradigm_list: a paradigm list, lemma_to_paradigm and the progress
+
+
+def save_paradigm_checkpoint(paradigm_list, lemma_to_paradigm, lemmas_done, last_lemma, path):
+    """Sections: those of the paradigm list, (lemma, paradigm index) pairs and (lemmas done, last lemma).
+    The file is written next to path and renamed, so an interrupted save leaves the previous checkpoint intact."""
+    strings = StringTable()
+    sections = paradigm_list_sections(paradigm_list, strings)
+    assignments = array('I')
+    for index, lemmas in sorted(lemma_to_paradigm.items()):
+        for lemma in sorted(lemmas):
+            assignments.extend((strings.add(lemma), index))
+    progress = array('I', (lemmas_done, strings.add(last_lemma or '')))
+    write_store(path + '.tmp', KIND_PARADIGM_CHECKPOINT, strings, sections + [assignments, progress])
+    os.replace(path + '.tmp', path)
+
+
+def load_paradigm_checkpoint(path):
+    """(paradigm list, lemma_to_paradigm, lemmas done, last lemma) saved by save_paradigm_checkpoint"""
+    paradigms = ParadigmList(path, KIND_PARADIGM_CHECKPOINT)
+    strings = paradigms.store.strings
+    assignments, progress = paradigms.store.sections[5:7]
+    lemma_to_paradigm = defaultdict(set)
+    for i in range(0, len(assignments), 2):
+        lemma_to_paradigm[assignments[i + 1]].add(strings[assignments[i]])
+    lemmas_done, last_lemma = progress
+    return paradigms.to_list(), lemma_to_paradigm, lemmas_done, strings[last_lemma] if lemmas_done else None
@@ -0,0 +1,22 @@
+from allomorphy import Model
+from reader import iter_unprocessed_data
+
+
+def learn_classes(**kwargs):
+    model = Model()
+    with open('test_tur.csv', encoding='utf-8') as file:
+        model.learn_letter_classes(iter_unprocessed_data(file), **kwargs)
+    return model.letter_classes
+
+
+def test_learned_classes_are_vowel_harmony():
+    # the endings of different lemmas alternate a/e and ı/i, the stems must not add classes of consonants
+    assert learn_classes() == [('a', 'e'), ('i', 'ı')]
+    assert learn_classes(separate=True) == [('a', 'e'), ('i', 'ı')]
+
+
+def test_classes_do_not_chain():
+    # with a low threshold, a letter substituted for two letters that are not substituted for each other
+    # does not join them into one class
+    for letter_class in learn_classes(min_count=1):
+        assert len(letter_class) <= 2
@@ -0,0 +1,26 @@
+import random
+
+from helper import BitParallelLCSTable, LCS_bitparallel, LCS_dp, back_track_all, lcs_length_dp
+
+
+def random_pairs(count, length=12, letters='abdeiou'):
+    # vowels and consonants, so that the consonant bias of the traceback breaks ties
+    rng = random.Random(0)
+    for _ in range(count):
+        yield (''.join(rng.choice(letters) for _ in range(rng.randint(0, length))),
+               ''.join(rng.choice(letters) for _ in range(rng.randint(0, length))))
+
+
+def test_bitparallel_lcs_is_dp_lcs():
+    for X, Y in random_pairs(20000):
+        assert LCS_bitparallel(X, Y) == LCS_dp(X, Y), (X, Y)
+
+
+def test_bitparallel_table_is_dp_table():
+    for X, Y in random_pairs(3000, length=9):
+        C = lcs_length_dp(X, Y)
+        B = BitParallelLCSTable(X, Y)
+        assert len(B) == len(C)
+        for i in range(len(X) + 1):
+            assert [B[i][j] for j in range(len(Y) + 1)] == C[i], (X, Y, i)
+        assert back_track_all(B, X, Y, len(X), len(Y)) == back_track_all(C, X, Y, len(X), len(Y))
@@ -0,0 +1,49 @@
+import random
+from collections import defaultdict
+from difflib import ndiff
+
+from minimal_pair import Segmenter, char_diff
+from reader import iter_unprocessed_data
+
+
+def test_jobs_give_the_same_counts():
+    # the feature vectors are given as strings and include features that no schema was loaded for,
+    # so their bits are only known once the data is read
+    lemma_fv_form_dict = defaultdict(dict)
+    with open('test_tur.csv', encoding='utf-8') as file:
+        for form, lemma, fv in iter_unprocessed_data(file):
+            lemma_fv_form_dict[lemma][fv] = form
+            lemma_fv_form_dict[lemma + '-x'][fv + ';XNEW'] = form + 'x'
+
+    results = []
+    for jobs in (3, 1):
+        segmenter = Segmenter()
+        segmenter.lemma_fv_form_dict = lemma_fv_form_dict
+        segmenter.produce_possible_morphs_from_minimal_pair(jobs=jobs, shard_size=2)
+        results.append([(feature, list(morph_count.items()))
+                        for feature, morph_count in segmenter.feature_morph_count.items()])
+    assert results[0] == results[1]
+    assert results[0]
+
+
+def ndiff_diff(form1, form2):
+    """What minimal_pair did before char_diff"""
+    delta = list(ndiff(form1, form2))
+    return ''.join([x[2:] for x in delta if x.startswith('-')]), ''.join([x[2:] for x in delta if x.startswith('+')])
+
+
+def test_char_diff_is_ndiff():
+    rng = random.Random(0)
+    # spaces and tabs are the characters that ndiff treats as junk
+    for _ in range(20000):
+        form1 = ''.join(rng.choice('abc \t') for _ in range(rng.randint(0, 10)))
+        form2 = ''.join(rng.choice('abc \t') for _ in range(rng.randint(0, 10)))
+        assert char_diff(form1, form2) == ndiff_diff(form1, form2), (form1, form2)
+
+    # long forms around the 200 characters where char_diff falls back to ndiff
+    for _ in range(20):
+        base = ''.join(rng.choice('abcdefgh \t') for _ in range(rng.randint(190, 240)))
+        cut = rng.randint(0, len(base))
+        form1 = base + 'ler'
+        form2 = base[:cut] + ' x\t' + base[cut:] + 'lar'
+        assert char_diff(form1, form2) == ndiff_diff(form1, form2), (form1, form2)
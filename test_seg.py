@@ -0,0 +1,31 @@
+import random
+
+from seg import Segmenter
+
+
+def random_segmenter(rng, cache_size):
+    features = ['F{}'.format(i) for i in range(5)]
+    d = {}
+    for _ in range(rng.randint(1, 8)):
+        feature_set = frozenset(rng.sample(features, rng.randint(1, 3)))
+        d[feature_set] = [''.join(rng.choice('abc') for _ in range(rng.randint(1, 3)))
+                          for _ in range(rng.randint(1, 3))]
+    segmenter = Segmenter(cache_size=cache_size)
+    segmenter.feature_morpheme_dict = d
+    return segmenter, features
+
+
+def test_automaton_segments_like_replace():
+    rng = random.Random(0)
+    for cache_size in (0, 4):
+        for _ in range(500):
+            segmenter, features = random_segmenter(rng, cache_size)
+            for _ in range(10):
+                form = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 10)))
+                feature_vector = set(rng.sample(features, rng.randint(0, 5)))
+                expected = segmenter.attempt_segment_replace(form, feature_vector)
+                # twice, so that the second call can come from the cache
+                assert segmenter.attempt_segment(form, feature_vector) == expected
+                assert segmenter.attempt_segment(form, feature_vector) == expected
+        if cache_size:
+            assert segmenter.cache_hits
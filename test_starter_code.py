@@ -0,0 +1,24 @@
+import random
+
+from starter_code import LCSSegmentLocator, find_lcs_seg, segment_lcs
+
+
+def random_subsequence(rng, word):
+    return ''.join(c for c in word if rng.random() < 0.6)
+
+
+def test_locator_finds_the_same_segments():
+    rng = random.Random(0)
+    none_count = 0
+    for _ in range(20000):
+        word = ''.join(rng.choice('abc') for _ in range(rng.randint(0, 12)))
+        # mostly an LCS of the word's cluster, i.e. a subsequence of it, sometimes a string that does not fit
+        if rng.random() < 0.7:
+            lcs = random_subsequence(rng, word)
+        else:
+            lcs = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 6)))
+        expected = find_lcs_seg(word, 0, segment_lcs(lcs)[0], [])
+        assert LCSSegmentLocator(word).locate(lcs) == expected, (word, lcs)
+        none_count += expected is None and lcs != ""
+    # the cases where part of a non-empty LCS can't be placed are covered
+    assert none_count